@@ -3,78 +3,95 @@
 import sys
 import os
 import re
+import glob
+import fcntl
+import shlex
+import tempfile
+import threading
 import configparser
 
-def get_value(cfg_file, section, key, default = None):
-    """Get a value from the config file."""
+_parsed_cache = {}
+_parsed_cache_lock = threading.Lock()
+_scanned_cache = {}
+
+class ConfigError(Exception):
+    pass
+
+def load_config(cfg_file):
+    """Parse the config file, reusing the previous parse while mtime and size are unchanged."""
+    try:
+        st = os.stat(cfg_file)
+    except OSError:
+        return configparser.ConfigParser()
+
+    stamp = (st.st_mtime_ns, st.st_size)
+    with _parsed_cache_lock:
+        cached = _parsed_cache.get(cfg_file)
+        if cached and cached[0] == stamp:
+            return cached[1]
+
     cfg = configparser.ConfigParser()
     cfg.read(cfg_file)
 
+    with _parsed_cache_lock:
+        _parsed_cache[cfg_file] = (stamp, cfg)
+    return cfg
+
+def _get_value(cfg, section, key, default=None):
     if default is None:
         if not cfg.has_section(section):
             raise KeyError(f"Section '{section}' not found in config")
         if not cfg.has_option(section, key):
             raise KeyError(f"Key '{key}' not found in section '{section}'")
 
-    print(cfg.get(section, key, fallback=default).strip())
-
-def set_value(cfg_file, section, key, value, create_section=True, create_key=True):
-    """Comment out a section header and all its keys."""
-    if not os.path.exists(cfg_file):
-        print(f"ERROR: Config file '{cfg_file}' does not exist", file=sys.stderr)
-        sys.exit(1)
+    return cfg.get(section, key, fallback=default).strip()
 
-    with open(cfg_file, 'r') as f:
-        lines = f.readlines()
+def get_value(cfg_file, section, key, default = None):
+    """Get a value from the config file."""
+    return _get_value(load_config(cfg_file), section, key, default)
 
+def _set_value_lines(lines, section, key, value, create_section=True, create_key=True):
     any_section_re = re.compile(r"^\s*\[.*\]\s*$")
     section_re = re.compile(rf"\[\s*{re.escape(section)}\s*\]\s*$")
     key_re = re.compile(rf"^\s*{re.escape(key)}\s*[=:]")
 
     section_found = False
     key_found = False
+    # Where the section ends, new keys and sections are inserted there
+    end = len(lines)
 
     for i, line in enumerate(lines):
         if any_section_re.match(line) and section_found:
+            end = i
             break
         if section_re.match(line):
             section_found = True
         elif section_found and line.strip() == "":
+            end = i
             break
         elif section_found and key_re.match(line):
             if key_found:
-                print(f"ERROR: Duplicate key '{key}' found in section '{section}'", file=sys.stderr)
-                sys.exit(1)
+                raise ConfigError(f"Duplicate key '{key}' found in section '{section}'")
             lines[i] = f"{key}: {value}\n"
             key_found = True
 
+    if lines and end == len(lines) and not lines[-1].endswith("\n"):
+        lines[-1] += "\n"
+
     if not section_found:
         if not create_section:
-            print(f"ERROR: Section '{section}' does not exist for update", file=sys.stderr)
-            sys.exit(1)
-        lines.insert(i, f"\n[{section}]\n")
-        i += 1
+            raise ConfigError(f"Section '{section}' does not exist for update")
+        lines.insert(end, f"\n[{section}]\n" if lines else f"[{section}]\n")
+        end += 1
 
     if not key_found:
         if not create_key:
-            print(f"ERROR: Key '{key}' does not exist in section '{section}' for update", file=sys.stderr)
-            sys.exit(1)
-        lines.insert(i, f"{key}: {value}\n")
-
-    with open(cfg_file, 'w') as f:
-        f.writelines(lines)
-
-    print(f"[{section}] {key}: {value}")
-
-def comment_section(cfg_file, section_name):
-    """Comment out a section header and all its keys."""
-    if not os.path.exists(cfg_file):
-        print(f"ERROR: Config file '{cfg_file}' does not exist", file=sys.stderr)
-        sys.exit(1)
+            raise ConfigError(f"Key '{key}' does not exist in section '{section}' for update")
+        lines.insert(end, f"{key}: {value}\n")
 
-    with open(cfg_file, 'r') as f:
-        lines = f.readlines()
+    return f"[{section}] {key}: {value}"
 
+def _comment_section_lines(lines, section_name):
     section_re = re.compile(rf"\[\s*{re.escape(section_name)}\s*\]\s*$")
     comment_re = re.compile(r"^\s*#")
     comment = False
@@ -90,22 +107,10 @@ def comment_section(cfg_file, section_name):
             changed.append(lines[i])
 
     if comment:
-        with open(cfg_file, 'w') as f:
-            f.writelines(lines)
-        print("OK")
-        print("".join(changed).rstrip())
-    else:
-        print(f"No section found to comment")
-
-def uncomment_section(cfg_file, section_name):
-    """Uncomment a section header and all its keys."""
-    if not os.path.exists(cfg_file):
-        print(f"ERROR: Config file '{cfg_file}' does not exist", file=sys.stderr)
-        sys.exit(1)
-
-    with open(cfg_file, 'r') as f:
-        lines = f.readlines()
+        return "OK\n" + "".join(changed).rstrip()
+    return "No section found to comment"
 
+def _uncomment_section_lines(lines, section_name):
     uncomment = False
     section_re = re.compile(rf"#\s*\[{re.escape(section_name)}\]\s*$")
     comment_re = re.compile(r"^#\s*")
@@ -121,12 +126,343 @@ def uncomment_section(cfg_file, section_name):
             break
 
     if uncomment:
-        with open(cfg_file, 'w') as f:
-            f.writelines(lines)
-        print("OK")
-        print("".join(changed).rstrip())
-    else:
-        print(f"No section found to uncomment")
+        return "OK\n" + "".join(changed).rstrip()
+    return "No section found to uncomment"
+
+class ConfigTransaction:
+    """Any number of edits of a config file, written back once and atomically.
+
+    The directory of the file is locked with flock() for the whole
+    transaction, so concurrent writers are serialized instead of losing
+    updates. The new content is written to a temporary file, fsynced and
+    renamed over the old one; nothing is written if it did not change.
+
+        with ConfigTransaction(cfg_file) as tx:
+            tx.set_value("camera", "stack", "paxx12")
+            tx.uncomment_section("webcam gui")
+    """
+
+    def __init__(self, cfg_file):
+        self.cfg_file = os.path.realpath(cfg_file)
+        self.lines = []
+        self.exists = False
+        self.changed = False
+        self._original = None
+        self._lock_fd = None
+
+    def __enter__(self):
+        try:
+            self._lock_fd = os.open(os.path.dirname(self.cfg_file), os.O_RDONLY)
+        except FileNotFoundError:
+            raise ConfigError(f"Config file '{self.cfg_file}' does not exist")
+        try:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_EX)
+            try:
+                with open(self.cfg_file, 'r') as f:
+                    self.lines = f.readlines()
+                self.exists = True
+            except FileNotFoundError:
+                self.lines = []
+            self._original = "".join(self.lines)
+        except BaseException:
+            os.close(self._lock_fd)
+            raise
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if exc_type is None:
+                self.commit()
+        finally:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+
+    def _require_file(self):
+        if not self.exists:
+            raise ConfigError(f"Config file '{self.cfg_file}' does not exist")
+
+    def get_value(self, section, key, default=None):
+        cfg = configparser.ConfigParser()
+        cfg.read_string("".join(self.lines), self.cfg_file)
+        return _get_value(cfg, section, key, default)
+
+    def set_value(self, section, key, value, create_section=True, create_key=True):
+        self._require_file()
+        return _set_value_lines(self.lines, section, key, value, create_section, create_key)
+
+    def comment_section(self, section_name):
+        self._require_file()
+        return _comment_section_lines(self.lines, section_name)
+
+    def uncomment_section(self, section_name):
+        self._require_file()
+        return _uncomment_section_lines(self.lines, section_name)
+
+    def commit(self):
+        """Write the edits if the content changed, returns whether it was written."""
+        content = "".join(self.lines)
+        if content == self._original:
+            return False
+
+        directory = os.path.dirname(self.cfg_file)
+        st = os.stat(self.cfg_file)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(self.cfg_file)}.")
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(content)
+                f.flush()
+                os.fchmod(f.fileno(), st.st_mode & 0o7777)
+                try:
+                    # Keep the file writable for its owner (e.g. lava) when running as root
+                    os.fchown(f.fileno(), st.st_uid, st.st_gid)
+                except PermissionError:
+                    pass
+                os.fsync(f.fileno())
+            os.rename(tmp_path, self.cfg_file)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+
+        dir_fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+        self._original = content
+        self.changed = True
+        return True
+
+def _run_transaction(cfg_file, operation, *args):
+    try:
+        with ConfigTransaction(cfg_file) as tx:
+            message = getattr(tx, operation)(*args)
+    except ConfigError as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        sys.exit(1)
+    print(message)
+
+def set_value(cfg_file, section, key, value, create_section=True, create_key=True):
+    """Set a value, creating the section or key if allowed."""
+    _run_transaction(cfg_file, "set_value", section, key, value, create_section, create_key)
+
+def comment_section(cfg_file, section_name):
+    """Comment out a section header and all its keys."""
+    _run_transaction(cfg_file, "comment_section", section_name)
+
+def uncomment_section(cfg_file, section_name):
+    """Uncomment a section header and all its keys."""
+    _run_transaction(cfg_file, "uncomment_section", section_name)
+
+BATCH_OPERATIONS = {
+    # operation: (transaction method, argument counts, extra arguments)
+    'get': ("get_value", (2, 3), ()),
+    'add': ("set_value", (3,), (True, True)),
+    'update': ("set_value", (3,), (False, True)),
+    'comment': ("comment_section", (1,), ()),
+    'uncomment': ("uncomment_section", (1,), ()),
+}
+
+def batch(cfg_file, operations):
+    """Apply operations (lists like ['add', section, key, value]) in one transaction.
+
+    Either all edits are written or, if one fails, none of them.
+    """
+    output = []
+    with ConfigTransaction(cfg_file) as tx:
+        for operation in operations:
+            if not operation:
+                continue
+            name, args = operation[0], operation[1:]
+            if name not in BATCH_OPERATIONS or len(args) not in BATCH_OPERATIONS[name][1]:
+                raise ConfigError(f"Invalid batch operation: {shlex.join(operation)}")
+            method, _, extra = BATCH_OPERATIONS[name]
+            output.append(getattr(tx, method)(*args, *extra))
+    return output
+
+def env_name(*parts):
+    return re.sub(r"[^A-Za-z0-9_]", "_", "_".join(parts)).upper()
+
+def env_assignments(cfg_file, prefix="CFG_"):
+    """Shell assignments PREFIX_SECTION_KEY='value' for all values of the config file."""
+    cfg = load_config(cfg_file)
+    result = []
+    for section in cfg.sections():
+        for key in cfg.options(section):
+            try:
+                value = cfg.get(section, key)
+            except configparser.InterpolationError:
+                value = cfg.get(section, key, raw=True)
+            result.append(f"{env_name(prefix + section, key)}={shlex.quote(value.strip())}")
+    return result
+
+SECTION_RE = re.compile(r"\[(?P<header>.+)\]")
+OPTION_RE = re.compile(r"(?P<option>.*?)\s*[=:]\s*(?P<value>.*)$")
+INLINE_COMMENT_RE = re.compile(r"\s;")
+
+def scan_config_file(cfg_file):
+    """Split a Klipper/Moonraker config file into (kind, line, ...) entries.
+
+    Kinds are ('section', line, name), ('option', line, key, value),
+    ('include', line, spec) and ('error', line, message). Lines are read like
+    Klipper does: '#' starts a comment anywhere, ';' at the start of a line or
+    after whitespace, indented lines continue the previous value and options
+    after an [include] need a new section header. The result is cached while
+    mtime and size are unchanged, raises OSError if the file is unreadable.
+    """
+    st = os.stat(cfg_file)
+    stamp = (st.st_mtime_ns, st.st_size)
+    with _parsed_cache_lock:
+        cached = _scanned_cache.get(cfg_file)
+        if cached and cached[0] == stamp:
+            return cached[1]
+
+    with open(cfg_file, 'r', errors='replace') as f:
+        lines = f.read().splitlines()
+
+    entries = []
+    section = None
+    option = None
+    indent = 0
+    for lineno, line in enumerate(lines, 1):
+        line = line.split('#', 1)[0]
+        if line.lstrip().startswith(';'):
+            line = ""
+        match = INLINE_COMMENT_RE.search(line)
+        if match:
+            line = line[:match.start()]
+        value = line.strip()
+        if not value:
+            continue
+
+        cur_indent = len(line) - len(line.lstrip())
+        if option and cur_indent > indent:
+            kind, start, key, text = entries[option]
+            entries[option] = (kind, start, key, f"{text}\n{value}")
+            continue
+
+        indent = cur_indent
+        option = None
+        header = SECTION_RE.match(value)
+        if header and header.group('header').startswith('include '):
+            entries.append(('include', lineno, header.group('header')[8:].strip()))
+            section = None
+        elif header:
+            section = header.group('header')
+            entries.append(('section', lineno, section))
+        elif section is None:
+            entries.append(('error', lineno, f"Option outside of a section: {value}"))
+        else:
+            match = OPTION_RE.match(value)
+            if not match or not match.group('option'):
+                entries.append(('error', lineno, f"Invalid line: {value}"))
+                continue
+            option = len(entries)
+            entries.append(('option', lineno, match.group('option').lower(), match.group('value')))
+
+    with _parsed_cache_lock:
+        _scanned_cache[cfg_file] = (stamp, entries)
+    return entries
+
+def check_include_tree(cfg_file):
+    """Resolve the [include] tree of a Klipper or Moonraker config without starting them.
+
+    Includes are globs relative to the including file, expanded in sorted
+    order; a missing file without glob characters and a recursive include are
+    errors, like in Klipper. Sections defined more than once are merged with
+    later values winning, these are reported as warnings. Returns a dict with
+    'files', the merged 'sections' ({section: {key: value}}), 'errors' and
+    'warnings' (dicts with 'file', 'line' and 'message'). File names are
+    relative to the directory of cfg_file.
+    """
+    base_dir = os.path.dirname(os.path.abspath(cfg_file))
+    result = {"files": [], "sections": {}, "errors": [], "warnings": []}
+    section_origin = {}
+    option_origin = {}
+    visited = set()
+
+    def name(path):
+        return os.path.relpath(path, base_dir)
+
+    def report(kind, path, line, message):
+        result[kind].append({"file": name(path), "line": line, "message": message})
+
+    def visit(path, source, source_line):
+        real = os.path.abspath(path)
+        if real in visited:
+            report("errors", source, source_line, f"Recursive include of config file '{name(path)}'")
+            return
+        try:
+            entries = scan_config_file(path)
+        except OSError as e:
+            report("errors", source, source_line, f"Unable to read config file '{name(path)}': {e.strerror}")
+            return
+
+        visited.add(real)
+        result["files"].append(name(path))
+        section = None
+        for entry in entries:
+            kind, line = entry[0], entry[1]
+            if kind == 'error':
+                report("errors", path, line, entry[2])
+            elif kind == 'include':
+                section = None
+                spec = entry[2]
+                if not spec:
+                    report("errors", path, line, "Include without a file name")
+                    continue
+                pattern = os.path.join(os.path.dirname(path), spec)
+                include_files = sorted(glob.glob(pattern))
+                if not include_files and not glob.has_magic(pattern):
+                    report("errors", path, line, f"Include file '{name(pattern)}' does not exist")
+                for include_file in include_files:
+                    visit(include_file, path, line)
+            elif kind == 'section':
+                section = entry[2]
+                if section in section_origin:
+                    first_path, first_line = section_origin[section]
+                    report("warnings", path, line, f"Duplicate section [{section}], first defined at {first_path}:{first_line}")
+                else:
+                    section_origin[section] = (name(path), line)
+                    result["sections"][section] = {}
+            else:
+                key, value = entry[2], entry[3]
+                previous = option_origin.get((section, key))
+                if previous and result["sections"][section][key] != value:
+                    report("warnings", path, line,
+                           f"[{section}] {key} overrides the value from {previous[0]}:{previous[1]}")
+                option_origin[section, key] = (name(path), line)
+                result["sections"][section][key] = value
+        visited.discard(real)
+
+    visit(cfg_file, cfg_file, 0)
+    return result
+
+def format_check_report(result):
+    """Lines describing the errors and warnings of check_include_tree()."""
+    def where(item):
+        return f"{item['file']}:{item['line']}" if item["line"] else item["file"]
+
+    lines = [f"ERROR: {where(item)}: {item['message']}" for item in result["errors"]]
+    lines += [f"WARNING: {where(item)}: {item['message']}" for item in result["warnings"]]
+    lines.append(f"{'FAILED' if result['errors'] else 'OK'}: {len(result['files'])} files, "
+                 f"{len(result['sections'])} sections, {len(result['errors'])} errors, "
+                 f"{len(result['warnings'])} warnings")
+    return lines
+
+def format_merged_config(result):
+    """The effective config of check_include_tree() in config file syntax."""
+    lines = []
+    for section, options in result["sections"].items():
+        lines.append(f"[{section}]")
+        for key, value in options.items():
+            first, *rest = value.split("\n")
+            lines.append(f"{key}: {first}".rstrip())
+            lines.extend(f"  {line}" for line in rest)
+        lines.append("")
+    return lines
 
 def main():
     if len(sys.argv) < 2:
@@ -136,14 +472,20 @@ def main():
         print("  update <cfg_file> <section> <key> <value> - Update existing config value only", file=sys.stderr)
         print("  comment <cfg_file> <section>              - Comment section header", file=sys.stderr)
         print("  uncomment <cfg_file> <section>            - Uncomment section header", file=sys.stderr)
+        print("  batch <cfg_file> [operation ...]          - Apply operations (e.g. \"add camera stack paxx12\")", file=sys.stderr)
+        print("                                              from arguments or stdin lines in one write", file=sys.stderr)
+        print("  env <cfg_file> [prefix]                   - Print all values as shell assignments for eval,", file=sys.stderr)
+        print("                                              named <prefix><SECTION>_<KEY> (default prefix CFG_)", file=sys.stderr)
+        print("  check <cfg_file>                          - Check a Klipper/Moonraker config and its includes", file=sys.stderr)
+        print("  merged <cfg_file>                         - Print the config with all includes merged", file=sys.stderr)
         sys.exit(1)
 
     if sys.argv[1] == 'get' and len(sys.argv) == 5:
         _, cfg_file, section, key = sys.argv[1:5]
-        get_value(cfg_file, section, key)
+        print(get_value(cfg_file, section, key))
     elif sys.argv[1] == 'get' and len(sys.argv) == 6:
         _, cfg_file, section, key, default = sys.argv[1:6]
-        get_value(cfg_file, section, key, default)
+        print(get_value(cfg_file, section, key, default))
     elif sys.argv[1] == 'add' and len(sys.argv) == 6:
         _, cfg_file, section, key, value = sys.argv[1:6]
         set_value(cfg_file, section, key, value, create_section=True, create_key=True)
@@ -156,6 +498,35 @@ def main():
     elif sys.argv[1] == 'uncomment' and len(sys.argv) == 4:
         _, cfg_file, section = sys.argv[1:4]
         uncomment_section(cfg_file, section)
+    elif sys.argv[1] == 'batch' and len(sys.argv) >= 3:
+        cfg_file = sys.argv[2]
+        lines = sys.argv[3:] if len(sys.argv) > 3 else sys.stdin.read().splitlines()
+        try:
+            output = batch(cfg_file, [shlex.split(line, comments=True) for line in lines])
+        except (ConfigError, KeyError, ValueError) as e:
+            print(f"ERROR: {e}", file=sys.stderr)
+            sys.exit(1)
+        for message in output:
+            print(message)
+    elif sys.argv[1] == 'env' and len(sys.argv) in (3, 4):
+        cfg_file = sys.argv[2]
+        prefix = sys.argv[3] if len(sys.argv) == 4 else "CFG_"
+        for assignment in env_assignments(cfg_file, prefix):
+            print(assignment)
+    elif sys.argv[1] == 'check' and len(sys.argv) == 3:
+        result = check_include_tree(sys.argv[2])
+        for line in format_check_report(result):
+            print(line)
+        if result["errors"]:
+            sys.exit(1)
+    elif sys.argv[1] == 'merged' and len(sys.argv) == 3:
+        result = check_include_tree(sys.argv[2])
+        for line in format_merged_config(result):
+            print(line)
+        if result["errors"]:
+            for line in format_check_report(result):
+                print(line, file=sys.stderr)
+            sys.exit(1)
     else:
         print("ERROR: Invalid arguments", file=sys.stderr)
         sys.exit(1)
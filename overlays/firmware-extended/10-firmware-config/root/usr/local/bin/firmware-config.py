@@ -1,15 +1,33 @@
 #!/usr/bin/env python3
 
 import argparse
+import email.utils
+import errno
+import fnmatch
 import glob
+import gzip
+import hashlib
+import importlib.machinery
+import importlib.util
 import json
+import mimetypes
 import os
+import posixpath
+import queue
+import re
+import select
+import signal
+import socket
+import struct
 import subprocess
 import time
 import fcntl
-import yaml
-from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
-from urllib.parse import urlparse
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import parse_qs, unquote, urlparse
+
+FUNCTIONS_CACHE_VERSION = 1
 
 def deep_merge(base, override):
     """Deep merge override into base, modifying base in place."""
@@ -20,29 +38,320 @@ def deep_merge(base, override):
             base[key] = value
     return base
 
-def load_functions_from_dir(functions_dir):
-    """Load and deep merge all YAML files from a directory in sorted order."""
+def yaml_safe_loader():
+    """Import yaml on first use and prefer the libyaml based loader."""
+    import yaml
+    return yaml, getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+def functions_cache_key(yaml_files):
+    # Whole seconds, squashfs does not keep sub-second mtimes
+    key = []
+    for yaml_file in yaml_files:
+        st = os.stat(yaml_file)
+        key.append([os.path.basename(yaml_file), int(st.st_mtime), st.st_size])
+    return key
+
+def read_functions_cache(cache_path, key):
+    """Return the cached merged functions if the cache matches key, otherwise None."""
+    try:
+        with open(cache_path, 'r') as f:
+            cache = json.load(f)
+        if cache.get('version') == FUNCTIONS_CACHE_VERSION and cache.get('key') == key:
+            return cache['functions']
+    except (OSError, ValueError, KeyError, AttributeError):
+        pass
+    return None
+
+def write_functions_cache(cache_path, key, config):
+    data = json.dumps({'version': FUNCTIONS_CACHE_VERSION, 'key': key, 'functions': config}, separators=(',', ':'))
+    # Non-string keys or YAML-only types would not survive the round trip
+    if json.loads(data)['functions'] != config:
+        log("Functions cache not written: functions do not round-trip through JSON")
+        return False
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, 'w') as f:
+            f.write(data)
+        os.replace(tmp_path, cache_path)
+        return True
+    except OSError as e:
+        log(f"Functions cache not written: {e}")
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        return False
+
+def load_functions_from_dir(functions_dir, cache_path=None, use_cache=True):
+    """Load and deep merge all YAML files from a directory in sorted order, returns a FunctionRegistry.
+
+    With cache_path the merged result is cached as JSON keyed on the file
+    names, mtimes and sizes, and a matching cache is used without parsing
+    any YAML (unless use_cache is False).
+    """
     config = {'links': {}, 'settings': {}, 'actions': {}, 'status': {}, 'upgrade_url': {}, 'upgrade_upload': {}}
+    errors = []
 
     if not os.path.isdir(functions_dir):
         log(f"Functions directory not found: {functions_dir}")
-        return config
+        return FunctionRegistry(config, [f"Functions directory not found: {functions_dir}"])
 
     yaml_files = sorted(glob.glob(os.path.join(functions_dir, '*.yaml')))
     yaml_files += sorted(glob.glob(os.path.join(functions_dir, '*.yml')))
     yaml_files = sorted(set(yaml_files))
 
+    key = None
+    if cache_path:
+        try:
+            key = functions_cache_key(yaml_files)
+        except OSError:
+            key = None
+        cached = read_functions_cache(cache_path, key) if key is not None and use_cache else None
+        if cached is not None:
+            log(f"Loaded {len(yaml_files)} function files from cache: {cache_path}")
+            return FunctionRegistry(cached)
+
+    yaml, loader = yaml_safe_loader()
     for yaml_file in yaml_files:
         try:
             with open(yaml_file, 'r') as f:
-                data = yaml.safe_load(f)
+                data = yaml.load(f, Loader=loader)
                 if data:
                     deep_merge(config, data)
             log(f"Loaded functions from: {os.path.basename(yaml_file)}")
         except Exception as e:
             log(f"Error loading {yaml_file}: {e}")
+            errors.append(f"{os.path.basename(yaml_file)}: {e}")
+
+    if key is not None and not errors:
+        write_functions_cache(cache_path, key, config)
+    return FunctionRegistry(config, errors)
+
+def build_actions_catalog(functions):
+    """Build the /api/actions response, it only depends on the loaded functions."""
+    result = {}
+    for group_key, group_cfg in functions.get('actions', {}).items():
+        actions_list = []
+        for action_id, cfg in group_cfg.get('items', {}).items():
+            actions_list.append({
+                "id": action_id,
+                "label": cfg.get("label", action_id),
+                "confirm": cfg.get("confirm", False),
+                "background": cfg.get("background", False),
+                "download_file": cfg.get("download_file")
+            })
+        if actions_list:
+            result[group_key] = {
+                "label": group_cfg.get('label', group_key),
+                "items": actions_list
+            }
+    return result
+
+def build_links_catalog(functions):
+    """Build the list of (condition, link) pairs used by /api/links."""
+    result = []
+    for _, link_config in functions.get('links', {}).items():
+        result.append((link_config.get("condition"), {
+            "url": link_config["url"],
+            "icon": link_config["icon"],
+            "label": link_config["label"]
+        }))
+    return result
+
+def build_settings_catalog(functions):
+    """Build the static part of the /api/settings response."""
+    result = {}
+    for group_key, group_cfg in functions.get('settings', {}).items():
+        items = []
+        for setting_id, config in group_cfg.get('items', {}).items():
+            items.append({
+                "id": setting_id,
+                "label": config["label"],
+                "options": {opt_key: opt_val["label"] for opt_key, opt_val in config["options"].items()}
+            })
+        if items:
+            result[group_key] = {
+                "label": group_cfg.get('label', group_key),
+                "items": items
+            }
+    return result
+
+def encode_json(data):
+    """Encode a JSON response body, returns (body, etag)."""
+    body = json.dumps(data, indent=2).encode()
+    return body, '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+class FunctionRegistry:
+    """Functions loaded from the YAML files, compiled for request handling.
+
+    A registry is never modified once load_static_status() filled it and it
+    was published. Reloading builds a new one and swaps it in, requests in
+    flight keep the one they started with.
+    """
+
+    def __init__(self, functions, errors=()):
+        self.functions = functions
+        self.errors = list(errors)
+        self.duplicates = []
+        self.settings = self._index('settings')
+        self.actions = self._index('actions')
+        self.actions_catalog = build_actions_catalog(functions)
+        self.actions_response = encode_json(self.actions_catalog)
+        self.links_catalog = build_links_catalog(functions)
+        self.settings_catalog = build_settings_catalog(functions)
+        self.setting_keys = [item["id"] for group in self.settings_catalog.values() for item in group["items"]]
+        self.link_setting_keys = list(dict.fromkeys(
+            condition["setting"] for condition, _ in self.links_catalog if condition))
+        self.static_status = {}
+
+    def native_status(self, key, item):
+        """Evaluate a native status provider, items marked static come from load_static_status()."""
+        if key in self.static_status:
+            return self.static_status[key], True
+        return evaluate_status_provider(item)
+
+    def load_static_status(self):
+        """Evaluate the items marked static once, before the registry is used by requests.
+
+        A static item that fails here is evaluated on every request instead.
+        """
+        for section_key, section_cfg in self.functions.get('status', {}).items():
+            for index, item in enumerate(section_cfg.get('items', [])):
+                if item.get('static'):
+                    value, ok = evaluate_status_provider(item)
+                    if ok:
+                        self.static_status[(section_key, index)] = value
+
+    def _index(self, kind):
+        """Map item IDs to their config, the first group defining an ID wins."""
+        index = {}
+        groups = {}
+        for group_key, group_cfg in self.functions.get(kind, {}).items():
+            for item_id, cfg in group_cfg.get('items', {}).items():
+                if item_id in index:
+                    message = f"Duplicate {kind[:-1]} ID '{item_id}' in group '{group_key}' is shadowed by group '{groups[item_id]}'"
+                    log(message)
+                    self.duplicates.append(message)
+                    continue
+                index[item_id] = cfg
+                groups[item_id] = group_key
+        return index
+
+class FunctionsWatcher:
+    """Calls on_change after YAML files in the functions directory change.
+
+    Uses inotify through libc, or polls file mtimes where it is not available.
+    Events are collected for settle seconds so an editor saving several files
+    causes a single reload.
+    """
+
+    IN_CLOSE_WRITE = 0x008
+    IN_MOVED_FROM = 0x040
+    IN_MOVED_TO = 0x080
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+    IN_CLOEXEC = 0o2000000
+    EVENT_HEADER = struct.Struct("iIII")
+
+    def __init__(self, functions_dir, on_change, settle=0.5, poll_interval=2.0):
+        self.functions_dir = functions_dir
+        self.on_change = on_change
+        self.settle = settle
+        self.poll_interval = poll_interval
+
+    def start(self):
+        threading.Thread(target=self._run, name="functions-watcher", daemon=True).start()
+
+    def _inotify_fd(self):
+        try:
+            import ctypes
+            import ctypes.util
+            libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            fd = libc.inotify_init1(self.IN_CLOEXEC)
+            if fd < 0:
+                return None
+            mask = self.IN_CLOSE_WRITE | self.IN_MOVED_FROM | self.IN_MOVED_TO | self.IN_CREATE | self.IN_DELETE
+            if libc.inotify_add_watch(fd, os.fsencode(self.functions_dir), mask) < 0:
+                os.close(fd)
+                return None
+            return fd
+        except (OSError, AttributeError):
+            return None
+
+    def _yaml_changed(self, data):
+        offset = 0
+        while offset + self.EVENT_HEADER.size <= len(data):
+            _, _, _, length = self.EVENT_HEADER.unpack_from(data, offset)
+            offset += self.EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b"\0")
+            offset += length
+            if name.endswith((b".yaml", b".yml")):
+                return True
+        return False
+
+    def _snapshot(self):
+        result = {}
+        for path in glob.glob(os.path.join(self.functions_dir, '*.y*ml')):
+            try:
+                st = os.stat(path)
+                result[path] = (st.st_mtime_ns, st.st_size)
+            except OSError:
+                pass
+        return result
 
-    return config
+    def _run(self):
+        fd = self._inotify_fd()
+        if fd is None:
+            log(f"inotify not available, polling {self.functions_dir} every {self.poll_interval}s")
+            self._poll()
+            return
+
+        while True:
+            try:
+                changed = self._yaml_changed(os.read(fd, 65536))
+                # Let a burst of writes settle before reloading
+                while select.select([fd], [], [], self.settle)[0]:
+                    changed = self._yaml_changed(os.read(fd, 65536)) or changed
+                if changed:
+                    self.on_change()
+            except Exception as e:
+                log(f"Functions watcher error: {e}")
+                time.sleep(self.poll_interval)
+
+    def _poll(self):
+        previous = self._snapshot()
+        while True:
+            time.sleep(self.poll_interval)
+            try:
+                current = self._snapshot()
+                if current != previous:
+                    previous = current
+                    self.on_change()
+            except Exception as e:
+                log(f"Functions watcher error: {e}")
+
+def load_extended_config():
+    """Import extended-config.py from the same directory as a module."""
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "extended-config.py")
+    if not os.path.exists(path):
+        return None
+    try:
+        loader = importlib.machinery.SourceFileLoader("extended_config", path)
+        spec = importlib.util.spec_from_loader(loader.name, loader)
+        module = importlib.util.module_from_spec(spec)
+        loader.exec_module(module)
+        return module
+    except Exception as e:
+        log(f"Error loading {path}: {e}")
+        return None
+
+def extended_config_get_args(cmd):
+    """Return (cfg_file, section, key[, default]) if cmd is an `extended-config.py get` call."""
+    if not isinstance(cmd, list) or len(cmd) not in (5, 6):
+        return None
+    if os.path.basename(cmd[0]) != "extended-config.py" or cmd[1] != "get":
+        return None
+    return cmd[2:]
 
 def log(msg):
     ts = time.strftime('%H:%M:%S')
@@ -55,18 +364,1421 @@ def shell_to_cmd(shell, *args):
         cmd.extend(args)
     return cmd
 
-class FirmwareConfigHandler(SimpleHTTPRequestHandler):
-    html_dir = None
-    functions = {'settings': {}, 'links': {}, 'actions': {}, 'status': {}, 'upgrade_url': {}, 'upgrade_upload': {}}
+class SpawnedProcess:
+    """A command started with os.posix_spawnp(), a small subset of subprocess.Popen.
+
+    posix_spawn uses vfork semantics, so starting a command does not copy
+    the page tables of the server process however large it is. The command
+    leads its own session, kill() stops everything it started.
+    """
+
+    def __init__(self, cmd, shell=False, capture=True, merge_stderr=False):
+        self.args = cmd
+        if shell:
+            cmd = ["/bin/sh", "-c", cmd]
+        self.returncode = None
+        self.stdout = None
+        file_actions = [(os.POSIX_SPAWN_OPEN, 0, os.devnull, os.O_RDONLY, 0)]
+        if not capture:
+            self.pid = os.posix_spawnp(cmd[0], cmd, os.environ, file_actions=file_actions, setsid=True)
+            return
 
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, directory=self.html_dir, **kwargs)
+        read_fd, write_fd = os.pipe()
+        file_actions.append((os.POSIX_SPAWN_DUP2, write_fd, 1))
+        if merge_stderr:
+            file_actions.append((os.POSIX_SPAWN_DUP2, write_fd, 2))
+        else:
+            file_actions.append((os.POSIX_SPAWN_OPEN, 2, os.devnull, os.O_WRONLY, 0))
+        try:
+            self.pid = os.posix_spawnp(cmd[0], cmd, os.environ, file_actions=file_actions, setsid=True)
+        except BaseException:
+            os.close(read_fd)
+            raise
+        finally:
+            os.close(write_fd)
+        self.stdout = os.fdopen(read_fd, "rb")
+
+    def poll(self):
+        if self.returncode is None:
+            pid, status = os.waitpid(self.pid, os.WNOHANG)
+            if pid:
+                self.returncode = os.waitstatus_to_exitcode(status)
+        return self.returncode
+
+    def wait(self, timeout=None):
+        if timeout is None:
+            if self.returncode is None:
+                _, status = os.waitpid(self.pid, 0)
+                self.returncode = os.waitstatus_to_exitcode(status)
+            return self.returncode
+        deadline = time.monotonic() + timeout
+        delay = 0.001
+        while self.poll() is None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise subprocess.TimeoutExpired(self.args, timeout)
+            time.sleep(min(delay, remaining))
+            delay = min(delay * 2, 0.05)
+        return self.returncode
+
+    def kill(self):
+        try:
+            os.killpg(self.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            pass
+
+    def detach(self):
+        """Reap the command in the background, for commands that outlive the caller."""
+        threading.Thread(target=self.wait, name=f"reap-{self.pid}", daemon=True).start()
+
+def run_command(cmd, timeout=None, shell=False):
+    """Run cmd to completion, returns (returncode, stdout) with stderr discarded.
+
+    On timeout the command and everything it started is killed and
+    subprocess.TimeoutExpired is raised.
+    """
+    process = SpawnedProcess(cmd, shell=shell)
+    deadline = None if timeout is None else time.monotonic() + timeout
+    fd = process.stdout.fileno()
+    poller = select.poll()
+    poller.register(fd, select.POLLIN)
+    chunks = []
+    try:
+        while True:
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not poller.poll(remaining * 1000):
+                    raise subprocess.TimeoutExpired(cmd, timeout)
+            data = os.read(fd, 65536)
+            if not data:
+                break
+            chunks.append(data)
+        process.wait(None if deadline is None else max(0, deadline - time.monotonic()))
+    except BaseException:
+        process.kill()
+        process.wait()
+        raise
+    finally:
+        process.stdout.close()
+    return process.returncode, b"".join(chunks).decode("utf-8", "replace")
+
+class Metrics:
+    """Thread-safe counters and histograms, rendered in the Prometheus text format.
+
+    Samples are keyed by metric name and a sorted tuple of label pairs.
+    Gauges are callbacks evaluated when the metrics are rendered.
+    """
+
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+        self._counters = {}
+        self._histograms = {}
+        self._gauges = {}
+
+    def counter(self, name, help_text):
+        self._metrics[name] = ("counter", help_text)
+
+    def histogram(self, name, help_text):
+        self._metrics[name] = ("histogram", help_text)
+
+    def gauge(self, name, help_text, fn):
+        """Register a gauge, fn() returns a value or a list of (labels, value)."""
+        self._metrics[name] = ("gauge", help_text)
+        self._gauges[name] = fn
+
+    def inc(self, metric, value=1, /, **labels):
+        key = (metric, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, metric, value, /, **labels):
+        key = (metric, tuple(sorted(labels.items())))
+        with self._lock:
+            sample = self._histograms.get(key)
+            if sample is None:
+                sample = self._histograms[key] = [[0] * len(self.BUCKETS), 0, 0.0]
+            for i, bound in enumerate(self.BUCKETS):
+                if value <= bound:
+                    sample[0][i] += 1
+            sample[1] += 1
+            sample[2] += value
+
+    @staticmethod
+    def _labels(labels, extra=()):
+        pairs = list(labels) + list(extra)
+        if not pairs:
+            return ""
+        escaped = (str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, v in pairs)
+        return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+    def render(self):
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: (list(s[0]), s[1], s[2]) for key, s in self._histograms.items()}
+
+        lines = []
+        for name, (kind, help_text) in self._metrics.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            if kind == "counter":
+                for (metric, labels), value in sorted(counters.items()):
+                    if metric == name:
+                        lines.append(f"{name}{self._labels(labels)} {value}")
+            elif kind == "histogram":
+                for (metric, labels), (buckets, count, total) in sorted(histograms.items()):
+                    if metric != name:
+                        continue
+                    for bound, bucket_count in zip(self.BUCKETS, buckets):
+                        lines.append(f"{name}_bucket{self._labels(labels, [('le', bound)])} {bucket_count}")
+                    lines.append(f"{name}_bucket{self._labels(labels, [('le', '+Inf')])} {count}")
+                    lines.append(f"{name}_count{self._labels(labels)} {count}")
+                    lines.append(f"{name}_sum{self._labels(labels)} {total:.6f}")
+            else:
+                try:
+                    value = self._gauges[name]()
+                except Exception as e:
+                    log(f"Metrics gauge {name} error: {e}")
+                    continue
+                samples = value if isinstance(value, list) else [({}, value)]
+                for labels, sample in samples:
+                    lines.append(f"{name}{self._labels(sorted(labels.items()))} {sample}")
+        return ("\n".join(lines) + "\n").encode("utf-8")
+
+METRICS = Metrics()
+METRICS.counter("firmware_config_requests_total", "HTTP requests by route, method and status code")
+METRICS.histogram("firmware_config_request_duration_seconds", "HTTP request handling time by route, streams included")
+METRICS.counter("firmware_config_subprocess_spawns_total", "Processes started by kind")
+METRICS.histogram("firmware_config_command_duration_seconds", "Execution time of status, condition and get_cmd commands")
+METRICS.counter("firmware_config_command_timeouts_total", "Status, condition and get_cmd commands that hit their timeout")
+METRICS.counter("firmware_config_streamed_bytes_total", "Bytes of uploads received and downloads sent or fetched")
+METRICS.counter("firmware_config_connections_reclaimed_total", "Idle keep-alive connections closed to admit a new one")
+METRICS.counter("firmware_config_connections_rejected_total", "Connections answered with 503 because all were busy")
+
+def completed_future(result):
+    future = Future()
+    future.set_result(result)
+    return future
+
+def status_item_name(section_key, index, item):
+    return f"{section_key}/{item.get('label') or index}"
+
+METRICS_ROUTES = ("/api/status", "/api/status/stream", "/api/settings", "/api/links", "/api/actions",
+                  "/api/bootstrap", "/api/jobs", "/api/upgrade/url", "/api/upgrade/upload", "/metrics")
+
+def request_route(path):
+    """Map a request path to a route template, so metric labels stay bounded."""
+    if path in METRICS_ROUTES:
+        return path
+    if path.startswith("/api/jobs/"):
+        return "/api/jobs/<id>/log" if path.endswith("/log") else "/api/jobs/<id>"
+    if path.startswith("/api/action/"):
+        return "/api/action/<action>/download" if path.endswith("/download") else "/api/action/<action>"
+    if path.startswith("/api/settings/"):
+        return "/api/settings/<option>/<value>"
+    if path.startswith("/api/"):
+        return "other"
+    return "static"
+
+def request_endpoint(method, path):
+    """Map a request to the endpoint class its in-flight limit is counted in."""
+    if path == "/api/status/stream":
+        return "stream"
+    if path.startswith("/api/jobs"):
+        return "jobs"
+    if path.startswith("/api/upgrade/"):
+        return "upgrade"
+    if path.startswith("/api/action/") and path.endswith("/download"):
+        return "download"
+    if method == "POST":
+        return "command"
+    if path.startswith("/api/"):
+        return "api"
+    return "static"
+
+SIOCGIFADDR = 0x8915
+SIOCGIWAP = 0x8B15
+SIOCGIWESSID = 0x8B1B
+IW_ESSID_MAX_SIZE = 32
+
+def read_text_file(path):
+    try:
+        with open(path) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+def _ifreq(interface, size=40):
+    return struct.pack(f"{size}s", interface.encode()[:15])
+
+def netif_ipv4(interface):
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        try:
+            result = fcntl.ioctl(s.fileno(), SIOCGIFADDR, _ifreq(interface))
+        except OSError as e:
+            # No address assigned or no such interface
+            if e.errno in (errno.EADDRNOTAVAIL, errno.ENODEV):
+                return None
+            raise
+    return socket.inet_ntoa(result[20:24])
+
+def provider_file(item):
+    return read_text_file(item['file'])
+
+def provider_proc_cmdline(item):
+    """Value of the first kernel parameter matching the proc_cmdline pattern."""
+    for param in (read_text_file("/proc/cmdline") or "").split():
+        key, _, value = param.partition("=")
+        if fnmatch.fnmatchcase(key, item['proc_cmdline']):
+            return value
+    return None
+
+def provider_netif(item):
+    interface = item['netif']
+    field = item.get('field', 'ipv4')
+    if field == 'ipv4':
+        return netif_ipv4(interface)
+    if field in ('mac', 'address'):
+        return read_text_file(f"/sys/class/net/{interface}/address")
+    if field in ('state', 'operstate'):
+        return read_text_file(f"/sys/class/net/{interface}/operstate")
+    if field == 'speed':
+        speed = read_text_file(f"/sys/class/net/{interface}/speed")
+        return f"{speed} Mb/s" if speed and not speed.startswith("-") else None
+    raise ValueError(f"Unknown netif field: {field}")
+
+def provider_wifi(item):
+    """SSID, BSSID and signal level via wireless extensions, like iwconfig."""
+    interface = item['wifi']
+    field = item.get('field', 'ssid')
+    if field == 'signal':
+        with open("/proc/net/wireless") as f:
+            for line in f:
+                name, _, values = line.partition(":")
+                if name.strip() == interface:
+                    level = int(float(values.split()[2]))
+                    # Drivers without IW_QUAL_DBM report the level unsigned
+                    return str(level - 256 if level > 63 else level)
+        return None
+
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        if field == 'ssid':
+            import ctypes
+            buf = bytearray(IW_ESSID_MAX_SIZE + 1)
+            buf_ptr = ctypes.addressof((ctypes.c_char * len(buf)).from_buffer(buf))
+            # struct iwreq: interface name and an iw_point pointing to buf
+            request = struct.pack("16sPHH", interface.encode()[:15], buf_ptr, len(buf), 0).ljust(32, b"\0")
+            result = fcntl.ioctl(s.fileno(), SIOCGIWESSID, request)
+            length = struct.unpack_from("16sPHH", result)[2]
+            return bytes(buf[:length]).rstrip(b"\0").decode("utf-8", "replace") or None
+        if field == 'bssid':
+            result = fcntl.ioctl(s.fileno(), SIOCGIWAP, _ifreq(interface, 32))
+            mac = result[18:24]
+            if not any(mac):
+                return "Not-Associated"
+            return ":".join(f"{b:02X}" for b in mac)
+    raise ValueError(f"Unknown wifi field: {field}")
+
+STATUS_PROVIDERS = {
+    'file': provider_file,
+    'proc_cmdline': provider_proc_cmdline,
+    'netif': provider_netif,
+    'wifi': provider_wifi,
+}
+
+_provider_errors = set()
+
+def evaluate_status_provider(item):
+    """Evaluate the native provider of a status item in-process.
+
+    Returns (value, ok), ok is False if the item has no provider or it
+    failed, its cmd is used instead then.
+    """
+    name = next((name for name in STATUS_PROVIDERS if name in item), None)
+    if name is None:
+        return None, False
+    try:
+        value = STATUS_PROVIDERS[name](item)
+    except Exception as e:
+        message = f"Status provider {name} error for {item.get('label', '')}: {e}"
+        if message not in _provider_errors:
+            _provider_errors.add(message)
+            log(message)
+        return None, False
+    if value is not None and 'map' in item:
+        value = item['map'].get(value, value)
+    return value, True
+
+def evaluate_status_condition(section_cfg):
+    """Evaluate if_exists of a status section, returns (enabled, ok) like evaluate_status_provider."""
+    path = section_cfg.get('if_exists')
+    if path is None:
+        return None, False
+    return os.path.exists(path), True
+
+class ResultCache:
+    """Thread-safe TTL cache that coalesces concurrent computations of the same key."""
+
+    class _Flight:
+        def __init__(self):
+            self.event = threading.Event()
+            self.value = None
+            self.error = None
+            self.stale = False
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._inflight = {}
+
+    def get(self, key, ttl, compute, timeout=None, store=None):
+        """Return cached value for key or compute it once for all concurrent callers.
+
+        Raises TimeoutError if another caller is computing the value and it
+        does not finish within timeout seconds.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > time.monotonic():
+                return entry[1]
+            flight = self._inflight.get(key)
+            owner = flight is None
+            if owner:
+                flight = self._inflight[key] = self._Flight()
+
+        if not owner:
+            if not flight.event.wait(timeout):
+                raise TimeoutError(f"Timed out waiting for {key}")
+            if flight.error:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = compute()
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+                if flight.error is None and not flight.stale and ttl > 0 and (store is None or store(flight.value)):
+                    self._entries[key] = (time.monotonic() + ttl, flight.value)
+            flight.event.set()
+        return flight.value
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+            flight = self._inflight.get(key)
+            if flight:
+                flight.stale = True
+
+class StatusSampler:
+    """Shared background sampler of status items for all /api/status/stream clients.
+
+    Every section condition and status item is sampled on its own interval
+    (`interval` in the functions YAML). The sampler runs only while at least
+    one client is subscribed, and each client receives a full snapshot
+    followed by updates of the items whose value changed.
+    """
+
+    class Subscriber:
+        def __init__(self):
+            self.queue = queue.Queue(maxsize=32)
+            self.needs_snapshot = True
+
+    def __init__(self, handler_cls, default_interval=5.0):
+        self.handler_cls = handler_cls
+        self.default_interval = default_interval
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._thread = None
+        self._values = {}
+        self._inflight = {}
+        self._snapshot = None
+        self._wake = threading.Event()
+
+    def subscribe(self):
+        sub = self.Subscriber()
+        with self._lock:
+            if self._snapshot is not None:
+                sub.queue.put(("snapshot", self._snapshot))
+                sub.needs_snapshot = False
+            self._subscribers.add(sub)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="status-sampler", daemon=True)
+                self._thread.start()
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            self._subscribers.discard(sub)
+
+    def _interval(self, cfg):
+        return float(cfg.get('interval', self.default_interval))
+
+    def _submit(self, key, fn, *args):
+        future = self.handler_cls.status_pool.submit(fn, *args)
+        future.add_done_callback(lambda _: self._wake.set())
+        self._inflight[key] = future
+
+    def _run(self):
+        next_due = {}
+        self._inflight = {}
+        started = time.monotonic()
+        while True:
+            with self._lock:
+                if not self._subscribers:
+                    self._thread = None
+                    self._values = {}
+                    self._snapshot = None
+                    for future in self._inflight.values():
+                        future.cancel()
+                    return
+
+            handler = self.handler_cls
+            registry = handler.registry
+            status_config = registry.functions.get('status', {})
+
+            for key, future in list(self._inflight.items()):
+                if future.done():
+                    del self._inflight[key]
+                    self._values[key] = future.result()
+
+            now = time.monotonic()
+            deadline = now + handler.status_cmd_timeout
+            for section_key, section_cfg in status_config.items():
+                if_cmd = section_cfg.get('if_cmd')
+                conditional = if_cmd or 'if_exists' in section_cfg
+                key = (section_key, None)
+                if conditional and key not in self._inflight and next_due.get(key, 0) <= now:
+                    next_due[key] = now + self._interval(section_cfg)
+                    enabled, ok = evaluate_status_condition(section_cfg)
+                    if ok:
+                        self._values[key] = enabled
+                    elif if_cmd:
+                        self._submit(key, handler._check_condition, if_cmd, deadline, handler._item_ttl(section_cfg),
+                                     section_key)
+
+                # Items of disabled sections are not sampled
+                if conditional and not self._values.get(key):
+                    continue
+                for index, item in enumerate(section_cfg.get('items', [])):
+                    key = (section_key, index)
+                    if key in self._inflight or next_due.get(key, 0) > now:
+                        continue
+                    value, ok = registry.native_status(key, item)
+                    if ok:
+                        next_due[key] = now + self._interval(item)
+                        self._values[key] = (value, False)
+                    elif 'cmd' in item:
+                        next_due[key] = now + self._interval(item)
+                        self._submit(key, handler._run_status_cmd, item['cmd'], deadline, handler._item_ttl(item),
+                                     status_item_name(section_key, index, item))
+
+            # Give the first round a moment to complete before the initial snapshot
+            if self._snapshot is not None or not self._inflight or now - started > 1.0:
+                self._publish(self._build_snapshot(status_config))
+
+            sleep_until = min(next_due.values(), default=now + self.default_interval)
+            self._wake.wait(min(1.0, max(0.05, sleep_until - time.monotonic())))
+            self._wake.clear()
+
+    def _build_snapshot(self, status_config):
+        snapshot = {}
+        for section_key, section_cfg in status_config.items():
+            conditional = section_cfg.get('if_cmd') or 'if_exists' in section_cfg
+            if conditional and not self._values.get((section_key, None)):
+                continue
+            section_items = []
+            for index, item in enumerate(section_cfg.get('items', [])):
+                value, timed_out = self._values.get((section_key, index), (None, False))
+                entry = {'label': item.get('label', ''), 'value': value}
+                if timed_out:
+                    entry['timed_out'] = True
+                section_items.append(entry)
+            if conditional and not any(entry['value'] for entry in section_items):
+                continue
+            snapshot[section_key] = {
+                'title': section_cfg.get('title', section_key),
+                'items': section_items
+            }
+        return snapshot
+
+    @staticmethod
+    def _diff(old, new):
+        sections = {}
+        for section_key, section in new.items():
+            old_section = old.get(section_key)
+            if old_section is None:
+                sections[section_key] = {
+                    'title': section['title'],
+                    'items': {str(i): entry for i, entry in enumerate(section['items'])}
+                }
+                continue
+            changed = {
+                str(i): entry for i, entry in enumerate(section['items'])
+                if i >= len(old_section['items']) or old_section['items'][i] != entry
+            }
+            if changed:
+                sections[section_key] = {'title': section['title'], 'items': changed}
+        removed = [section_key for section_key in old if section_key not in new]
+        if not sections and not removed:
+            return None
+        return {'sections': sections, 'removed': removed}
+
+    def _publish(self, snapshot):
+        with self._lock:
+            diff = self._diff(self._snapshot, snapshot) if self._snapshot is not None else None
+            self._snapshot = snapshot
+            for sub in self._subscribers:
+                if sub.needs_snapshot:
+                    event = ("snapshot", snapshot)
+                elif diff:
+                    event = ("update", diff)
+                else:
+                    continue
+                try:
+                    sub.queue.put_nowait(event)
+                    sub.needs_snapshot = False
+                except queue.Full:
+                    # Slow client: drop its backlog and resync with a full snapshot
+                    with sub.queue.mutex:
+                        sub.queue.queue.clear()
+                    sub.needs_snapshot = True
+
+class MultipartReader:
+    """Incremental multipart/form-data parser over a request body stream.
+
+    Data is read into a fixed size bytearray and handed out as memoryview
+    slices. The boundary search only covers newly received bytes plus the
+    tail that could hold a partial delimiter, so every byte is scanned once.
+    """
+
+    MAX_HEADER_SIZE = 16 * 1024
+
+    def __init__(self, stream, boundary, content_length, buffer_size=256 * 1024):
+        self.stream = stream
+        self.remaining = content_length
+        # Leading CRLF lets the first boundary match like all following ones
+        self.delimiter = b"\r\n--" + boundary.encode()
+        self.buf = bytearray(max(buffer_size, 2 * len(self.delimiter) + self.MAX_HEADER_SIZE))
+        self.view = memoryview(self.buf)
+        self.buf[0:2] = b"\r\n"
+        self.start = 0
+        self.end = 2
+        self.scanned = 0
+        self.finished = False
+
+    def _fill(self):
+        """Read more data into the buffer, returns False at end of body."""
+        if self.remaining <= 0:
+            return False
+        if self.end == len(self.buf):
+            pending = self.end - self.start
+            if pending == len(self.buf):
+                raise ValueError("Multipart buffer overflow")
+            self.view[0:pending] = self.view[self.start:self.end]
+            self.scanned -= self.start
+            self.start, self.end = 0, pending
+        n = self.stream.readinto(self.view[self.end:self.end + min(len(self.buf) - self.end, self.remaining)])
+        if not n:
+            self.remaining = 0
+            return False
+        self.remaining -= n
+        self.end += n
+        return True
+
+    def _find(self, needle):
+        """Find needle in unscanned data, returns absolute buffer index or -1."""
+        pos = self.buf.find(needle, max(self.start, self.scanned - len(needle) + 1), self.end)
+        self.scanned = self.end if pos < 0 else pos
+        return pos
+
+    def _expect(self, size):
+        while self.end - self.start < size:
+            if not self._fill():
+                raise ValueError("Unexpected end of multipart body")
+
+    def next_part(self):
+        """Advance to the next part, returns its headers or None after the last part."""
+        if self.finished:
+            return None
+        if self.start == 0 and self.scanned == 0:
+            # Skip preamble up to the first delimiter
+            self.read_part(None)
+            if self.finished:
+                return None
+
+        while True:
+            pos = self._find(b"\r\n\r\n")
+            if pos >= 0:
+                break
+            if self.end - self.start > self.MAX_HEADER_SIZE:
+                raise ValueError("Multipart headers too large")
+            if not self._fill():
+                raise ValueError("Unexpected end of multipart headers")
+
+        headers = {}
+        for line in bytes(self.view[self.start:pos]).decode("utf-8", "replace").split("\r\n"):
+            name, sep, value = line.partition(":")
+            if sep:
+                headers[name.strip().lower()] = value.strip()
+        self.start = pos + 4
+        self.scanned = self.start
+        return headers
+
+    def read_part(self, write):
+        """Pass the current part body to write() in memoryview chunks, returns its size."""
+        size = 0
+        keep = len(self.delimiter) - 1
+        while True:
+            pos = self._find(self.delimiter)
+            safe = pos if pos >= 0 else self.end - keep
+            if safe > self.start:
+                if write:
+                    write(self.view[self.start:safe])
+                size += safe - self.start
+                self.start = safe
+            if pos >= 0:
+                break
+            if not self._fill():
+                raise ValueError("Unexpected end of multipart body")
+
+        self.start += len(self.delimiter)
+        self._expect(2)
+        trailer = bytes(self.view[self.start:self.start + 2])
+        self.start += 2
+        if trailer == b"--":
+            self.finished = True
+            # Drain the epilogue so the connection stays usable
+            while self._fill():
+                self.start = self.end
+        elif trailer != b"\r\n":
+            raise ValueError("Malformed multipart boundary")
+        self.scanned = self.start
+        return size
+
+class FirmwareImageError(ValueError):
+    pass
+
+class FirmwareImageValidator:
+    """Validates an upgrade image (tools/upfile format) while it is being received.
+
+    The UPFILE header and file table are byte-mapped (see tools/upfile/helpers.h),
+    the SOC_FW entry holds a Rockchip RKFW update.img. Errors are raised from
+    feed() as soon as the first few hundred bytes are known.
+    """
+
+    HEADER_SIZE = 64
+    ENTRY_SIZE = 32
+    MAGIC = 0x4b4d4e53  # "SNMK"
+    MAX_FILES = 4
+    RKFW_HEADER_SIZE = 102
+    # Allowance for multipart headers, boundaries and small form fields
+    MAX_REQUEST_OVERHEAD = 64 * 1024
+    DECODE_MAP = bytes.fromhex(
+        "00a2e90ede64ee12463be779a5805533323c0b7ececc5937019b4ec1ab187211"
+        "9c5be58de80d699729d9c5af4a617a6339c6bcd092ae7fdd6c073ab991f7c745"
+        "3440b52844e6cb4d3d9e942b60d22f3e67d652d3a8d4f81adaec707ca01d064f"
+        "6e2db836f04322bdb4829deba45676e425159871c350497708fb4723aa8a20fc"
+        "f68c85301ec962ba530ff257517b131f96c0357387dbb7a3ed905f9adce3e10a"
+        "1b17ea41fe5826cd05c202886a9f9374e22a09ac815c1cf38bfa84a1d75dbe75"
+        "38e0a62c2e6686ef5468b6a9f50cf9b3bf14b2fdbbd504f4a748f16d6b997d4b"
+        "b0ad2195d1cfc424ca8eb18316df1910274c6f313f5a6578c8d803895e8f42ff")
+
+    def __init__(self, content_length=None):
+        self.reset(content_length)
+
+    def reset(self, content_length=None):
+        """Forget everything fed so far, for a download that starts over."""
+        self.content_length = content_length
+        # Only the bytes from head_offset to needed are buffered, the
+        # header and file table first, then the RKFW header of SOC_FW
+        self.head = bytearray()
+        self.head_offset = 0
+        self.needed = self.HEADER_SIZE
+        self.entries = None
+        self.total_size = None
+        self.version = None
+        self.received = 0
+
+    @staticmethod
+    def _checksum_ok(data, checksum_offset):
+        stored = int.from_bytes(data[checksum_offset:checksum_offset + 2], "big")
+        calculated = (sum(data) - data[checksum_offset] - data[checksum_offset + 1]) & 0xFFFF
+        return stored == calculated
+
+    def feed(self, data):
+        data_offset = self.received
+        self.received += len(data)
+        while self.needed:
+            # Bytes before head_offset (the SOC_FW data) are not buffered
+            pos = self.head_offset + len(self.head) - data_offset
+            take = self.needed - self.head_offset - len(self.head)
+            if take > 0:
+                if pos >= len(data):
+                    return
+                self.head += data[pos:pos + take]
+                if len(self.head) < self.needed - self.head_offset:
+                    return
+            self.needed = self._validate() or 0
+
+    def _validate(self):
+        """Validate what is buffered so far, returns the number of bytes needed next."""
+        if self.entries is None:
+            header = bytes(self.head[:self.HEADER_SIZE]).translate(self.DECODE_MAP)
+            if int.from_bytes(header[0:4], "little") != self.MAGIC:
+                raise FirmwareImageError("Not a firmware image (bad magic)")
+            if not self._checksum_ok(header, 6):
+                raise FirmwareImageError("Firmware header checksum mismatch")
+            files = int.from_bytes(header[46:48], "big")
+            if files == 0 or files > self.MAX_FILES:
+                raise FirmwareImageError(f"Invalid number of files in firmware image: {files}")
+            self.version = header[8:32].split(b"\0")[0].decode("ascii", "replace").strip()
+            self.entries = []
+            self.files = files
+            return self.HEADER_SIZE + files * self.ENTRY_SIZE
+
+        if self.total_size is None:
+            table_end = self.HEADER_SIZE + self.files * self.ENTRY_SIZE
+            ranges = []
+            for i in range(self.files):
+                start = self.HEADER_SIZE + i * self.ENTRY_SIZE
+                entry = bytes(self.head[start:start + self.ENTRY_SIZE]).translate(self.DECODE_MAP)
+                if not self._checksum_ok(entry, 2):
+                    raise FirmwareImageError(f"Firmware file table entry {i} checksum mismatch")
+                offset = int.from_bytes(entry[4:12], "big")
+                size = int.from_bytes(entry[12:16], "big")
+                if offset < table_end:
+                    raise FirmwareImageError(f"Firmware file table entry {i} overlaps header")
+                ranges.append((offset, size))
+                self.entries.append({"type": int.from_bytes(entry[0:2], "big"), "offset": offset, "size": size})
+            ranges.sort()
+            for (offset, size), (next_offset, _) in zip(ranges, ranges[1:]):
+                if offset + size > next_offset:
+                    raise FirmwareImageError("Firmware file table entries overlap")
+            self.total_size = max(offset + size for offset, size in ranges)
+            if self.content_length is not None:
+                if self.total_size > self.content_length:
+                    raise FirmwareImageError(
+                        f"Firmware image is truncated: declares {self.total_size} bytes, request has {self.content_length}")
+                if self.content_length - self.total_size > self.MAX_REQUEST_OVERHEAD:
+                    raise FirmwareImageError(
+                        f"Firmware image size mismatch: declares {self.total_size} bytes, request has {self.content_length}")
+            soc = self._soc_entry()
+            if soc["size"] < self.RKFW_HEADER_SIZE:
+                raise FirmwareImageError("Firmware SOC image is too small")
+            self.head = bytearray()
+            self.head_offset = soc["offset"]
+            return soc["offset"] + self.RKFW_HEADER_SIZE
+
+        soc = self._soc_entry()
+        rkfw = bytes(self.head[:self.RKFW_HEADER_SIZE])
+        if rkfw[0:4] != b"RKFW":
+            raise FirmwareImageError("Firmware SOC image is not a Rockchip update image (bad RKFW magic)")
+        loader_offset, loader_length, image_offset, image_length = (
+            int.from_bytes(rkfw[i:i + 4], "little") for i in range(25, 41, 4))
+        for name, offset, length in (("loader", loader_offset, loader_length), ("image", image_offset, image_length)):
+            if length == 0 or offset + length > soc["size"]:
+                raise FirmwareImageError(f"Firmware SOC {name} partition is outside of the image")
+        return None
+
+    def _soc_entry(self):
+        return next((entry for entry in self.entries if entry["type"] == 0), self.entries[0])
+
+    def finish(self):
+        if self.needed:
+            raise FirmwareImageError(f"Firmware image is too short ({self.received} bytes)")
+        if self.received != self.total_size:
+            raise FirmwareImageError(
+                f"Firmware image size mismatch: received {self.received} bytes, expected {self.total_size}")
+
+class DownloadError(Exception):
+    pass
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m"
+    if seconds >= 60:
+        return f"{seconds // 60}m{seconds % 60:02d}s"
+    return f"{seconds}s"
+
+CURL_BIN = "/usr/local/bin/curl"
+# curl exit codes handled by download_with_resume()
+CURL_HTTP_ERROR = 22
+CURL_RANGE_ERROR = 33
+
+def read_curl_headers(path):
+    """Status and headers of the last response curl dumped with -D, after redirects."""
+    try:
+        with open(path, "rb") as f:
+            text = f.read().decode("latin-1")
+    except OSError:
+        return None, {}
+    blocks = [block for block in re.split(r"\r?\n\r?\n", text) if block.startswith("HTTP/")]
+    if not blocks:
+        return None, {}
+    lines = blocks[-1].splitlines()
+    status = lines[0].split()[1] if len(lines[0].split()) > 1 else ""
+    headers = {}
+    for line in lines[1:]:
+        name, sep, value = line.partition(":")
+        if sep:
+            headers[name.strip().lower()] = value.strip()
+    return int(status) if status.isdigit() else None, headers
+
+def download_with_resume(url, target_path, progress=None, validator=None, retries=5, backoff=1.0,
+                         timeout=30, chunk_size=64 * 1024, progress_interval=1.0, curl=CURL_BIN):
+    """Download url to target_path with curl, resuming with -C after connection failures.
+
+    curl does the transfer (TLS, redirects), its output is hashed and
+    optionally validated while it is written. A validator is reset in
+    place when the download starts over. progress(done, total, rate, eta)
+    is called about every progress_interval seconds. Returns (size, sha256).
+    """
+    os.makedirs(os.path.dirname(target_path), exist_ok=True)
+    header_path = f"{target_path}.headers"
+    stderr_path = f"{target_path}.curl-log"
+    f = open(target_path, "wb")
+    try:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        digest = hashlib.sha256()
+        done = 0
+        total = None
+        etag = None
+        failures = 0
+        # Only new data resets the retry budget, so a server that keeps
+        # ignoring Range and dropping the connection still gives up
+        high_water = 0
+        started = time.monotonic()
+        last_report = 0
+        rate_mark = (started, 0)
+        rate = 0.0
+
+        while True:
+            cmd = [curl, "-sS", "-L", "-f", "-A", "firmware-config",
+                   "--connect-timeout", str(timeout), "--speed-limit", "1", "--speed-time", str(timeout),
+                   "-D", header_path, "--stderr", stderr_path]
+            if done > 0:
+                cmd += ["-C", str(done)]
+                if etag:
+                    cmd += ["-H", f"If-Range: {etag}"]
+            cmd += ["--url", url]
+
+            try:
+                process = SpawnedProcess(cmd)
+            except OSError as e:
+                raise DownloadError(f"Cannot run {curl}: {e}")
+            status = None
+            try:
+                while True:
+                    chunk = process.stdout.read1(chunk_size)
+                    if not chunk:
+                        break
+                    if status is None:
+                        # curl flushes the headers before it writes the body
+                        status, headers = read_curl_headers(header_path)
+                        if done > 0 and status == 206:
+                            content_range = headers.get("content-range", "")
+                            if not content_range.startswith(f"bytes {done}-"):
+                                raise DownloadError(f"Unexpected Content-Range: {content_range}")
+                            range_total = content_range.rpartition("/")[2]
+                            total = int(range_total) if range_total.isdigit() else None
+                        else:
+                            if done > 0:
+                                # Server ignored the range or the file changed, start over
+                                log(f"Download restarting from 0 (status {status})")
+                                f.seek(0)
+                                f.truncate()
+                                digest = hashlib.sha256()
+                                done = 0
+                                if validator:
+                                    validator.reset()
+                            length = headers.get("content-length", "")
+                            total = int(length) if length.isdigit() else None
+                            if validator and total is not None:
+                                validator.content_length = total
+                        etag = headers.get("etag") or headers.get("last-modified")
+                    if validator:
+                        validator.feed(chunk)
+                    f.write(chunk)
+                    digest.update(chunk)
+                    done += len(chunk)
+                    METRICS.inc("firmware_config_streamed_bytes_total", len(chunk), direction="url_download")
+                    if done > high_water:
+                        high_water = done
+                        failures = 0
+
+                    now = time.monotonic()
+                    if progress and now - last_report >= progress_interval:
+                        if now - rate_mark[0] > 0:
+                            rate = (done - rate_mark[1]) / (now - rate_mark[0])
+                        rate_mark = (now, done)
+                        eta = (total - done) / rate if total and rate > 0 else None
+                        progress(done, total, rate, eta)
+                        last_report = now
+                rc = process.wait()
+            finally:
+                if process.returncode is None:
+                    process.kill()
+                    process.wait()
+                process.stdout.close()
+
+            if rc == 0:
+                if total is None or done >= total:
+                    break
+                error = f"connection closed at {done} of {total} bytes"
+            else:
+                if status is None:
+                    status, _ = read_curl_headers(header_path)
+                try:
+                    with open(stderr_path, errors="replace") as err:
+                        error = err.read().strip() or f"curl exit code {rc}"
+                except OSError:
+                    error = f"curl exit code {rc}"
+                if rc == CURL_HTTP_ERROR and status is not None:
+                    if status == 416 and total is not None and done >= total:
+                        break
+                    if status < 500 and status not in (408, 429):
+                        raise DownloadError(f"HTTP error {status}")
+                if rc == CURL_RANGE_ERROR and done > 0:
+                    # Server ignored the range or the file changed, start over
+                    log(f"Download restarting from 0 ({error})")
+                    f.seek(0)
+                    f.truncate()
+                    digest = hashlib.sha256()
+                    done = 0
+                    total = None
+                    if validator:
+                        validator.reset()
+
+            failures += 1
+            if failures > retries:
+                raise DownloadError(f"Download failed after {retries} retries: {error}")
+            delay = min(30, backoff * 2 ** (failures - 1))
+            log(f"Download interrupted at {done} bytes ({error}), retrying in {delay}s")
+            if progress:
+                progress(done, total, 0.0, None, f"retry {failures}/{retries} in {delay}s: {error}")
+            time.sleep(delay)
+
+        if total is not None and done != total:
+            raise DownloadError(f"Download size mismatch: received {done} bytes, expected {total}")
+        if validator:
+            validator.finish()
+        if progress:
+            elapsed = time.monotonic() - started
+            progress(done, total, done / elapsed if elapsed > 0 else 0.0, 0)
+        f.close()
+        return done, digest.hexdigest()
+    except Exception:
+        f.close()
+        try:
+            os.unlink(target_path)
+        except Exception:
+            pass
+        raise
+    finally:
+        for path in (header_path, stderr_path):
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+def format_progress(done, total, rate, eta, note=None):
+    """Format a PROGRESS line as parsed by the web UI."""
+    fields = [f"bytes={done}", f"total={total if total is not None else '-'}", f"rate={int(rate)}",
+              f"eta={int(eta) if eta is not None else '-'}"]
+    summary = f"{done / 1048576:.1f} MB"
+    if total:
+        summary += f" / {total / 1048576:.1f} MB ({done * 100 / total:.1f}%)"
+    summary += f", {rate / 1048576:.2f} MB/s"
+    if eta is not None:
+        summary += f", ETA {format_duration(eta)}"
+    if note:
+        summary += f", {note}"
+    return f"PROGRESS: {' '.join(fields)} | {summary}\n"
+
+class JobLog:
+    """Fixed-size ring buffer of job output addressed by absolute byte offsets.
+
+    Once capacity bytes have been written the oldest output is overwritten,
+    readers that fall behind skip ahead to the oldest byte still kept.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.end = 0
+        self.closed = False
+        self._buf = bytearray()
+        self._cond = threading.Condition()
+
+    @property
+    def start(self):
+        return self.end - len(self._buf)
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        view = memoryview(data)
+        with self._cond:
+            while view:
+                if len(self._buf) < self.capacity:
+                    count = min(len(view), self.capacity - len(self._buf))
+                    self._buf += view[:count]
+                else:
+                    pos = self.end % self.capacity
+                    count = min(len(view), self.capacity - pos)
+                    self._buf[pos:pos + count] = view[:count]
+                self.end += count
+                view = view[count:]
+            self._cond.notify_all()
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+    def read(self, offset, timeout=None):
+        """Wait up to timeout for output past offset, returns (data, data_offset, closed)."""
+        with self._cond:
+            if timeout and self.end <= offset and not self.closed:
+                self._cond.wait_for(lambda: self.end > offset or self.closed, timeout)
+            offset = max(offset, self.start)
+            count = self.end - offset
+            if count <= 0:
+                return b"", self.end, self.closed
+            pos = offset % self.capacity
+            data = bytes(self._buf[pos:pos + count])
+            if len(data) < count:
+                data += self._buf[:count - len(data)]
+            return data, offset, self.closed
+
+class JobLimitError(Exception):
+    def __init__(self, job):
+        super().__init__(f"Another {job.kind} job is already running: {job.title} ({job.id})")
+        self.job = job
+
+class Job:
+    def __init__(self, kind, title, log_size, command_slots=None):
+        self.id = os.urandom(6).hex()
+        self.kind = kind
+        self.title = title
+        self.state = "running"
+        self.exit_code = None
+        self.created = time.time()
+        self.finished = None
+        self.log = JobLog(log_size)
+        self.command_slots = command_slots
+
+    def write(self, data):
+        self.log.write(data)
+
+    def run_command(self, cmd, stop_token=None):
+        """Run cmd with its output appended to the job log, returns (exit_code, stopped)."""
+        if self.command_slots:
+            self.command_slots.acquire()
+        try:
+            return self._run_command(cmd, stop_token)
+        finally:
+            if self.command_slots:
+                self.command_slots.release()
+
+    def _run_command(self, cmd, stop_token):
+        METRICS.inc("firmware_config_subprocess_spawns_total", kind=self.kind)
+        process = SpawnedProcess(cmd, merge_stderr=True)
+        token = stop_token.encode("utf-8") if stop_token else None
+        try:
+            for line in iter(process.stdout.readline, b""):
+                self.write(line)
+                if token and token in line:
+                    process.detach()
+                    return 0, True
+            process.wait()
+            return process.returncode, False
+        finally:
+            try:
+                process.stdout.close()
+            except Exception:
+                pass
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "type": self.kind,
+            "title": self.title,
+            "state": self.state,
+            "exit_code": self.exit_code,
+            "created": self.created,
+            "finished": self.finished,
+            "log_start": self.log.start,
+            "log_end": self.log.end,
+        }
+
+class JobManager:
+    """Runs actions, setting changes and upgrades independently of the HTTP request.
+
+    Jobs are limited per type (e.g. one upgrade at a time) and only the last
+    history finished jobs are kept, so memory is bounded by the log size.
+    """
+
+    def __init__(self, limits=None, log_size=128 * 1024, history=8, command_slots=None):
+        self.limits = limits or {}
+        self.log_size = log_size
+        self.history = history
+        self.command_slots = command_slots
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def create(self, kind, title):
+        """Register a running job, raises JobLimitError if its type is at the limit."""
+        with self._lock:
+            running = [job for job in self._jobs.values() if job.kind == kind and job.state == "running"]
+            limit = self.limits.get(kind)
+            if limit is not None and len(running) >= limit:
+                raise JobLimitError(running[0])
+            job = Job(kind, title, self.log_size, self.command_slots)
+            self._jobs[job.id] = job
+        log(f"Job {job.id} started: {kind} {title}")
+        return job
+
+    def start(self, job, work):
+        """Run work(job) in a thread, its return value is the job exit code."""
+        threading.Thread(target=self._run, args=(job, work), name=f"job-{job.id}", daemon=True).start()
+
+    def _run(self, job, work):
+        try:
+            exit_code = work(job)
+        except Exception as e:
+            log(f"Job {job.id} error: {e}")
+            job.write(f"\nError: {e}\n")
+            exit_code = 1
+        self.finish(job, exit_code)
+
+    def finish(self, job, exit_code):
+        job.exit_code = exit_code
+        job.state = "succeeded" if exit_code == 0 else "failed"
+        job.finished = time.time()
+        job.log.close()
+        log(f"Job {job.id} {job.state} (exit code: {exit_code})")
+        with self._lock:
+            finished = sorted((j for j in self._jobs.values() if j.finished), key=lambda j: j.finished)
+            for old in finished[:max(0, len(finished) - self.history)]:
+                del self._jobs[old.id]
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list(self):
+        with self._lock:
+            return sorted(self._jobs.values(), key=lambda j: j.created)
+
+def multipart_field_name(headers):
+    disposition = headers.get("content-disposition", "")
+    for param in disposition.split(";")[1:]:
+        key, _, value = param.strip().partition("=")
+        if key.strip().lower() == "name":
+            return value.strip().strip('"')
+    return None
+
+def accepts_gzip(accept_encoding):
+    for coding in accept_encoding.split(","):
+        name, _, params = coding.strip().partition(";")
+        if name.strip().lower() in ("gzip", "*"):
+            q = params.strip()
+            return not (q.startswith("q=") and q[2:].strip() in ("0", "0.0", "0.00", "0.000"))
+    return False
+
+def cmd_cache_key(kind, cmd):
+    return (kind, tuple(cmd) if isinstance(cmd, list) else cmd)
+
+class StaticAsset:
+    def __init__(self, path, mtimes, data, content_type):
+        self.path = path
+        self.mtimes = mtimes
+        self.data = data
+        self.content_type = content_type
+        self.etag = '"' + hashlib.sha256(data).hexdigest()[:32] + '"'
+        self.gzip_data = None
+        self.gzip_etag = None
+
+    def set_gzip(self, data):
+        if len(data) < len(self.data):
+            self.gzip_data = data
+            self.gzip_etag = self.etag[:-1] + '-gz"'
+
+class StaticAssets:
+    """In-memory copy of the html directory with gzip variants.
+
+    The directory is rescanned at most every check_interval seconds and
+    changed files are reloaded, so requests are normally served without
+    touching the disk. A file.gz next to a file is used as its gzip variant,
+    otherwise compressible files are gzipped at load time.
+    """
+
+    COMPRESSIBLE = ("text/", "application/javascript", "application/json", "image/svg+xml")
+    # Assets with a content hash in the name (app.1a2b3c4d.js) never change
+    VERSIONED_NAME = re.compile(r"\.[0-9a-f]{8,}\.[a-z0-9]+$")
+
+    def __init__(self, root, check_interval=2.0):
+        self.root = root
+        self.check_interval = check_interval
+        self._assets = {}
+        self._checked = 0
+        self._lock = threading.Lock()
+        self.refresh(force=True)
+
+    def refresh(self, force=False):
+        now = time.monotonic()
+        if not force and now - self._checked < self.check_interval:
+            return
+        with self._lock:
+            if not force and now - self._checked < self.check_interval:
+                return
+            self._checked = now
+            assets = {}
+            for dirpath, _, filenames in os.walk(self.root):
+                for filename in filenames:
+                    if filename.endswith(".gz"):
+                        continue
+                    path = os.path.join(dirpath, filename)
+                    url_path = "/" + os.path.relpath(path, self.root).replace(os.sep, "/")
+                    try:
+                        assets[url_path] = self._load(url_path, path)
+                    except OSError as e:
+                        log(f"Static asset error: {path}: {e}")
+            self._assets = assets
+
+    def _load(self, url_path, path):
+        mtime_ns = os.stat(path).st_mtime_ns
+        gz_path = path + ".gz"
+        gz_mtime_ns = os.stat(gz_path).st_mtime_ns if os.path.exists(gz_path) else None
+        current = self._assets.get(url_path)
+        if current and current.mtimes == (mtime_ns, gz_mtime_ns):
+            return current
+
+        with open(path, "rb") as f:
+            data = f.read()
+        content_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        if content_type.startswith("text/"):
+            content_type += "; charset=utf-8"
+        asset = StaticAsset(url_path, (mtime_ns, gz_mtime_ns), data, content_type)
+        if gz_mtime_ns is not None:
+            with open(gz_path, "rb") as f:
+                asset.set_gzip(f.read())
+        elif content_type.startswith(self.COMPRESSIBLE):
+            asset.set_gzip(gzip.compress(data, compresslevel=9, mtime=0))
+        return asset
+
+    def get(self, path):
+        self.refresh()
+        path = posixpath.normpath(unquote(path))
+        if path in ("/", "."):
+            path = "/index.html"
+        asset = self._assets.get(path)
+        if asset is None:
+            asset = self._assets.get(path.rstrip("/") + "/index.html")
+        return asset
+
+    def is_versioned(self, asset, query):
+        return bool(self.VERSIONED_NAME.search(asset.path)) or "v" in parse_qs(query)
+
+class FirmwareConfigHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Idle keep-alive connections are closed after this many seconds
+    timeout = 120
+    # Headers and body are separate writes, with Nagle the body of a
+    # keep-alive response waits for the client's delayed ACK (~40 ms)
+    disable_nagle_algorithm = True
+    html_dir = None
+    static_assets = None
+    registry = FunctionRegistry({'settings': {}, 'links': {}, 'actions': {}, 'status': {}, 'upgrade_url': {}, 'upgrade_upload': {}})
+    functions_dir = None
+    functions_cache = None
+    status_pool = None
+    status_deadline = 5.0
+    status_cmd_timeout = 5.0
+    cache = ResultCache()
+    cache_ttl = 5.0
+    extended_config = None
+    status_sampler = None
+    stream_keepalive = 15.0
+    command_slots = threading.BoundedSemaphore(8)
+    jobs = JobManager({"upgrade": 1, "setting": 1, "action": 2}, command_slots=command_slots)
+    # Requests handled at the same time per endpoint, more are answered with 503
+    endpoint_limits = {"stream": 32, "jobs": 32, "upgrade": 2, "download": 2, "command": 4, "api": 8, "static": 8}
+    _in_flight = dict.fromkeys(endpoint_limits, 0)
+    _in_flight_lock = threading.Lock()
+    _chunked = False
 
     def log_message(self, _format, *_args):
         pass
 
+    def log_request(self, code='-', size='-'):
+        self._status_code = code
+
+    def handle_one_request(self):
+        # Pin the registry for the whole request, a reload only swaps the class attribute
+        self.registry = type(self).registry
+        self.command = None
+        self._status_code = None
+        self._endpoint = None
+        # Until the request line arrives the connection can be reclaimed by the server
+        self.server.connection_idle(self.request, True)
+        started = time.monotonic()
+        try:
+            super().handle_one_request()
+        finally:
+            if self._endpoint:
+                with self._in_flight_lock:
+                    self._in_flight[self._endpoint] -= 1
+            if self.command:
+                route = request_route(urlparse(self.path).path)
+                method = self.command if self.command in ("GET", "HEAD", "POST") else "other"
+                code = int(self._status_code) if self._status_code else 0
+                METRICS.inc("firmware_config_requests_total", route=route, method=method, code=code)
+                METRICS.observe("firmware_config_request_duration_seconds", time.monotonic() - started, route=route)
+
+    def parse_request(self):
+        self.server.connection_idle(self.request, False)
+        if not super().parse_request():
+            return False
+        endpoint = request_endpoint(self.command, urlparse(self.path).path)
+        with self._in_flight_lock:
+            busy = self._in_flight[endpoint] >= self.endpoint_limits[endpoint]
+            if not busy:
+                self._in_flight[endpoint] += 1
+                self._endpoint = endpoint
+        if busy:
+            log(f"Busy: rejecting {self.command} {self.path}")
+            self.close_connection = True
+            self.send_response(503)
+            self.send_header("Retry-After", "1")
+            self.send_header("Content-Length", "0")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            return False
+        return True
+
+    @classmethod
+    def reload_functions(cls):
+        # Always parse: an edit within the same second and size would match the cache key
+        registry = load_functions_from_dir(cls.functions_dir, cls.functions_cache, use_cache=False)
+        if registry.errors:
+            log(f"Functions not reloaded, keeping the previous version: {'; '.join(registry.errors)}")
+            return False
+        registry.load_static_status()
+        cls.registry = registry
+        log(f"Functions reloaded: {len(registry.settings)} settings, {len(registry.actions)} actions")
+        return True
+
     def do_GET(self):
-        path = urlparse(self.path).path
+        parsed = urlparse(self.path)
+        path = parsed.path
         if path == "/api/status":
             self.handle_status()
         elif path == "/api/settings":
@@ -75,8 +1787,29 @@ class FirmwareConfigHandler(SimpleHTTPRequestHandler):
             self.handle_get_links()
         elif path == "/api/actions":
             self.handle_get_actions()
+        elif path == "/api/bootstrap":
+            self.handle_bootstrap()
+        elif path == "/api/status/stream":
+            self.handle_status_stream()
+        elif path == "/api/jobs":
+            self.handle_get_jobs()
+        elif path.startswith("/api/jobs/"):
+            path_parts = path[10:].split('/')
+            if len(path_parts) == 1:
+                self.handle_get_job(path_parts[0])
+            elif len(path_parts) == 2 and path_parts[1] == 'log':
+                self.handle_job_log(path_parts[0], parsed.query)
+            else:
+                self.send_error(404, "Invalid jobs path")
+        elif path.startswith("/api/action/") and path.endswith("/download"):
+            self.handle_action_download(path[12:-9])
+        elif path == "/metrics":
+            self.handle_metrics()
         else:
-            super().do_GET()
+            self.handle_static(parsed)
+
+    def do_HEAD(self):
+        self.handle_static(urlparse(self.path), head=True)
 
     def do_POST(self):
         parsed = urlparse(self.path)
@@ -85,6 +1818,7 @@ class FirmwareConfigHandler(SimpleHTTPRequestHandler):
         elif parsed.path == "/api/upgrade/upload":
             self.handle_upgrade_upload()
         elif parsed.path.startswith("/api/settings/"):
+            self._discard_request_body()
             path_parts = parsed.path[14:].split('/')
             if len(path_parts) == 2:
                 option = path_parts[0]
@@ -93,6 +1827,7 @@ class FirmwareConfigHandler(SimpleHTTPRequestHandler):
             else:
                 self.send_error(404, "Invalid settings path")
         elif parsed.path.startswith("/api/action/"):
+            self._discard_request_body()
             path_parts = parsed.path[12:].split('/')
             action = path_parts[0] if path_parts else None
             is_download = len(path_parts) > 1 and path_parts[1] == 'download'
@@ -106,42 +1841,91 @@ class FirmwareConfigHandler(SimpleHTTPRequestHandler):
         else:
             self.send_error(404, "Not Found")
 
-    def _start_text_stream(self):
+    def _start_stream(self, content_type, headers=()):
+        """Send headers for a response of unknown length, chunked unless the client speaks HTTP/1.0."""
+        self._chunked = self.request_version != "HTTP/1.0"
         self.send_response(200)
-        self.send_header("Content-Type", "text/plain; charset=utf-8")
-        self.send_header("X-Content-Type-Options", "nosniff")
+        self.send_header("Content-Type", content_type)
         self.send_header("Cache-Control", "no-cache")
+        for name, value in headers:
+            self.send_header(name, value)
+        if self._chunked:
+            self.send_header("Transfer-Encoding", "chunked")
+        else:
+            self.send_header("Connection", "close")
         self.end_headers()
 
+    def _start_text_stream(self, job=None):
+        headers = [("X-Content-Type-Options", "nosniff")]
+        if job:
+            headers.append(("X-Job-Id", job.id))
+        self._start_stream("text/plain; charset=utf-8", headers)
+
     def _write_stream_chunk(self, data):
         if isinstance(data, str):
             data = data.encode("utf-8")
+        if not data:
+            return
+        if self._chunked:
+            data = b"%x\r\n%s\r\n" % (len(data), data)
         self.wfile.write(data)
         self.wfile.flush()
 
     def _finish_text_stream(self):
-        pass
+        if self._chunked:
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+
+    def _discard_request_body(self):
+        """Read an unused request body so the connection can be reused."""
+        length = int(self.headers.get("Content-Length") or 0)
+        if self.headers.get("Transfer-Encoding") or length > 64 * 1024:
+            self.close_connection = True
+        elif length:
+            self.rfile.read(length)
+
+    def _stream_job(self, job, offset=0, follow=True):
+        """Stream job output from offset, the job keeps running if the client goes away."""
+        try:
+            self._start_text_stream(job)
+            while True:
+                data, data_offset, closed = job.log.read(offset, self.stream_keepalive if follow else None)
+                if data_offset > offset:
+                    self._write_stream_chunk(f"\n[... {data_offset - offset} bytes of output dropped ...]\n")
+                if data:
+                    self._write_stream_chunk(data)
+                offset = data_offset + len(data)
+                if not follow or (closed and not data):
+                    break
+            self._finish_text_stream()
+        except (BrokenPipeError, ConnectionResetError):
+            log(f"Client detached from job {job.id}")
 
-    def _stream_command(self, cmd, stop_token=None):
-        process = subprocess.Popen(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            text=True,
-            bufsize=1
-        )
-        try:
-            for line in iter(process.stdout.readline, ""):
-                self._write_stream_chunk(line)
-                if stop_token and stop_token in line:
-                    return 0, True
-            process.wait()
-            return process.returncode, False
-        finally:
-            try:
-                process.stdout.close()
-            except Exception:
-                pass
+    def _create_job(self, kind, title):
+        try:
+            return self.jobs.create(kind, title)
+        except JobLimitError as e:
+            self.send_error(409, str(e))
+            return None
+
+    def _check_configs(self, job, cfg_files):
+        """Check the Klipper/Moonraker configs in cfg_files before a restart, returns False on errors."""
+        if isinstance(cfg_files, str):
+            cfg_files = [cfg_files]
+        if not cfg_files:
+            return True
+        if not self.extended_config:
+            job.write("Config check skipped: extended-config.py not available\n")
+            return True
+
+        ok = True
+        for cfg_file in cfg_files:
+            result = self.extended_config.check_include_tree(cfg_file)
+            job.write(f"Checking {cfg_file}\n")
+            for line in self.extended_config.format_check_report(result):
+                job.write(f"{line}\n")
+            ok = ok and not result["errors"]
+        return ok
 
     def handle_action(self, action):
         try:
@@ -156,20 +1940,32 @@ class FirmwareConfigHandler(SimpleHTTPRequestHandler):
                 self._start_text_stream()
                 self._write_stream_chunk(f"=== {action} ===\n")
                 self._write_stream_chunk(f"{cfg['message']}\n")
-                subprocess.Popen(cfg["cmd"], start_new_session=True)
+                METRICS.inc("firmware_config_subprocess_spawns_total", kind="action")
+                SpawnedProcess(cfg["cmd"], capture=False).detach()
                 self._write_stream_chunk(f"\nSUCCESS: Completed successfully\n")
                 self._finish_text_stream()
-            else:
-                self._start_text_stream()
-                self._write_stream_chunk(f"=== {cfg.get('label', action)} ===\n")
-                self._write_stream_chunk(f"{cfg['message']}\n")
-                self._write_stream_chunk(f"\n")
-                exit_code, _ = self._stream_command(cfg["cmd"])
+                return
+
+            job = self._create_job("action", cfg.get('label', action))
+            if not job:
+                return
+
+            def work(job):
+                job.write(f"=== {cfg.get('label', action)} ===\n")
+                job.write(f"{cfg['message']}\n")
+                job.write(f"\n")
+                if not self._check_configs(job, cfg.get("check_config")):
+                    job.write(f"\nERROR: Configuration has errors, not running the action\n")
+                    return 1
+                exit_code, _ = job.run_command(cfg["cmd"])
                 if exit_code == 0:
-                    self._write_stream_chunk(f"\nSUCCESS: Completed successfully (exit code: 0)\n")
+                    job.write(f"\nSUCCESS: Completed successfully (exit code: 0)\n")
                 else:
-                    self._write_stream_chunk(f"\nERROR: Failed with exit code: {exit_code}\n")
-                self._finish_text_stream()
+                    job.write(f"\nERROR: Failed with exit code: {exit_code}\n")
+                return exit_code
+
+            self.jobs.start(job, work)
+            self._stream_job(job)
         except Exception as e:
             log(f"Action error: {e}")
             self.send_error(500, str(e))
@@ -191,214 +1987,439 @@ class FirmwareConfigHandler(SimpleHTTPRequestHandler):
                 self.send_error(404, f"Download file not found: {download_file}")
                 return
 
-            filename = os.path.basename(download_file)
-            self.send_response(200)
+            self.send_file(download_file, os.path.basename(download_file))
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        except Exception as e:
+            log(f"Action error: {e}")
+            self.send_error(500, str(e))
+
+    def _parse_range(self, size, etag, last_modified):
+        """Return (start, end) for a single satisfiable Range, None for the whole file, or False if unsatisfiable."""
+        range_header = self.headers.get("Range", "")
+        if not range_header.startswith("bytes=") or "," in range_header:
+            return None
+        if_range = self.headers.get("If-Range")
+        if if_range and if_range not in (etag, last_modified):
+            return None
+        first, _, last = range_header[6:].strip().partition("-")
+        try:
+            if first:
+                start = int(first)
+                end = min(int(last), size - 1) if last else size - 1
+            elif last:
+                start = max(0, size - int(last))
+                end = size - 1
+            else:
+                return None
+        except ValueError:
+            return None
+        if start > end or start >= size:
+            return False
+        return start, end
+
+    def send_file(self, path, filename):
+        """Send a file with sendfile(), honoring Range/If-Range and validators based on its mtime."""
+        with open(path, "rb") as f:
+            st = os.fstat(f.fileno())
+            size = st.st_size
+            etag = f'"{st.st_mtime_ns:x}-{size:x}"'
+            last_modified = email.utils.formatdate(st.st_mtime, usegmt=True)
+
+            if etag in [tag.strip() for tag in self.headers.get("If-None-Match", "").split(",")]:
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.send_header("Last-Modified", last_modified)
+                self.end_headers()
+                return
+
+            byte_range = self._parse_range(size, etag, last_modified)
+            if byte_range is False:
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{size}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+
+            start, end = byte_range or (0, size - 1)
+            self.send_response(206 if byte_range else 200)
             self.send_header("Content-Type", "application/octet-stream")
             self.send_header("Content-Disposition", f'attachment; filename="{filename}"')
+            self.send_header("Content-Length", str(end - start + 1))
+            if byte_range:
+                self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+            self.send_header("Accept-Ranges", "bytes")
+            self.send_header("ETag", etag)
+            self.send_header("Last-Modified", last_modified)
             self.send_header("X-Content-Type-Options", "nosniff")
             self.end_headers()
 
-            with open(download_file, "rb") as f:
-                chunk_size = 64 * 1024
-                while True:
-                    chunk = f.read(chunk_size)
-                    if not chunk:
-                        break
-                    self.wfile.write(chunk)
+            if end >= start:
+                self.wfile.flush()
+                sent = self.connection.sendfile(f, start, end - start + 1)
+                METRICS.inc("firmware_config_streamed_bytes_total", sent, direction="file_download")
+
+    def handle_static(self, parsed, head=False):
+        try:
+            asset = self.static_assets.get(parsed.path)
+            if asset is None:
+                self.send_error(404, "File not found")
+                return
+
+            use_gzip = asset.gzip_data is not None and accepts_gzip(self.headers.get("Accept-Encoding", ""))
+            data, etag = (asset.gzip_data, asset.gzip_etag) if use_gzip else (asset.data, asset.etag)
+            if self.static_assets.is_versioned(asset, parsed.query):
+                cache_control = "public, max-age=31536000, immutable"
+            else:
+                cache_control = "no-cache"
+
+            not_modified = etag in [tag.strip() for tag in self.headers.get("If-None-Match", "").split(",")]
+            self.send_response(304 if not_modified else 200)
+            self.send_header("ETag", etag)
+            self.send_header("Cache-Control", cache_control)
+            if asset.gzip_data is not None:
+                self.send_header("Vary", "Accept-Encoding")
+            if not not_modified:
+                self.send_header("Content-Type", asset.content_type)
+                self.send_header("Content-Length", str(len(data)))
+                if use_gzip:
+                    self.send_header("Content-Encoding", "gzip")
+            self.end_headers()
+            if not not_modified and not head:
+                self.wfile.write(data)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
         except Exception as e:
-            log(f"Action error: {e}")
+            log(f"Static error: {e}")
             self.send_error(500, str(e))
 
     def send_json(self, data):
-        response = json.dumps(data, indent=2).encode()
+        self.send_json_body(*encode_json(data))
+
+    def send_json_body(self, response, etag):
+        if etag in [tag.strip() for tag in self.headers.get("If-None-Match", "").split(",")]:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Cache-Control", "no-cache")
+            self.end_headers()
+            return
         self.send_response(200)
         self.send_header("Content-Type", "application/json")
         self.send_header("Content-Length", len(response))
+        self.send_header("ETag", etag)
+        self.send_header("Cache-Control", "no-cache")
         self.end_headers()
         self.wfile.write(response)
 
-    def _run_status_cmd(self, cmd):
+    @classmethod
+    def _item_ttl(cls, cfg):
+        return float(cfg.get('cache_ttl', cls.cache_ttl))
+
+    @staticmethod
+    def _run_timed(kind, name, cmd, timeout, shell=False):
+        """run_command() that records the command duration and timeouts in METRICS."""
+        METRICS.inc("firmware_config_subprocess_spawns_total", kind=kind)
+        started = time.monotonic()
         try:
-            result = subprocess.run(
-                cmd, shell=True, capture_output=True, text=True, timeout=5
-            )
-            return result.stdout.strip() if result.returncode == 0 else None
-        except Exception:
-            return None
+            return run_command(cmd, timeout=timeout, shell=shell)
+        except subprocess.TimeoutExpired:
+            METRICS.inc("firmware_config_command_timeouts_total", kind=kind, name=name)
+            raise
+        finally:
+            METRICS.observe("firmware_config_command_duration_seconds", time.monotonic() - started, kind=kind, name=name)
+
+    @classmethod
+    def _run_status_cmd(cls, cmd, deadline, ttl=0, name=None):
+        """Run a status command, returns (value, timed_out)."""
+        def compute():
+            if not cls.command_slots.acquire(timeout=max(0, deadline - time.monotonic())):
+                return None, True
+            try:
+                timeout = min(cls.status_cmd_timeout, deadline - time.monotonic())
+                if timeout <= 0:
+                    return None, True
+                returncode, stdout = cls._run_timed('status', name or cmd, cmd, timeout, shell=True)
+                return (stdout.strip() if returncode == 0 else None), False
+            except subprocess.TimeoutExpired:
+                return None, True
+            except Exception:
+                return None, False
+            finally:
+                cls.command_slots.release()
 
-    def _check_condition(self, cmd):
         try:
-            result = subprocess.run(cmd, shell=True, capture_output=True, timeout=5)
-            return result.returncode == 0
-        except Exception:
-            return False
+            return cls.cache.get(cmd_cache_key('status', cmd), ttl, compute,
+                                  timeout=max(0, deadline - time.monotonic()),
+                                  store=lambda result: not result[1])
+        except TimeoutError:
+            return None, True
+
+    @classmethod
+    def _check_condition(cls, cmd, deadline, ttl=0, name=None):
+        def compute():
+            if not cls.command_slots.acquire(timeout=max(0, deadline - time.monotonic())):
+                return None
+            try:
+                timeout = min(cls.status_cmd_timeout, deadline - time.monotonic())
+                if timeout <= 0:
+                    return None
+                returncode, _ = cls._run_timed('condition', name or cmd, cmd, timeout, shell=True)
+                return returncode == 0
+            except subprocess.TimeoutExpired:
+                return None
+            except Exception:
+                return False
+            finally:
+                cls.command_slots.release()
 
-    def handle_status(self):
         try:
-            status_config = self.functions.get('status', {})
-            result = {}
+            return bool(cls.cache.get(cmd_cache_key('condition', cmd), ttl, compute,
+                                       timeout=max(0, deadline - time.monotonic()),
+                                       store=lambda result: result is not None))
+        except TimeoutError:
+            return False
 
-            for section_key, section_cfg in status_config.items():
-                if_cmd = section_cfg.get('if_cmd')
-                if if_cmd and not self._check_condition(if_cmd):
-                    continue
+    def _submit_status_item(self, pool, key, item, deadline):
+        """Return a future of (value, timed_out) for a status item, None if it has no source."""
+        value, ok = self.registry.native_status(key, item)
+        if ok:
+            return completed_future((value, False))
+        if 'cmd' in item:
+            return pool.submit(self._run_status_cmd, item['cmd'], deadline, self._item_ttl(item),
+                               status_item_name(key[0], key[1], item))
+        return None
 
-                section_items = []
-                has_value = False
-                for item in section_cfg.get('items', []):
-                    value = self._run_status_cmd(item['cmd']) if 'cmd' in item else None
-                    if value:
-                        has_value = True
-                    section_items.append({
-                        'label': item.get('label', ''),
-                        'value': value
-                    })
-
-                if if_cmd and not has_value:
+    def _collect_status(self):
+        """Evaluate all status sections in parallel within a single deadline."""
+        status_config = self.registry.functions.get('status', {})
+        pool = self.status_pool
+        deadline = time.monotonic() + self.status_deadline
+
+        # Phase 1: evaluate all section conditions
+        conditions = {}
+        for section_key, section_cfg in status_config.items():
+            enabled, ok = evaluate_status_condition(section_cfg)
+            if ok:
+                conditions[section_key] = completed_future(enabled)
+            elif section_cfg.get('if_cmd'):
+                conditions[section_key] = pool.submit(self._check_condition, section_cfg['if_cmd'], deadline,
+                                                      self._item_ttl(section_cfg), section_key)
+        wait(conditions.values(), timeout=max(0, deadline - time.monotonic()))
+
+        # Phase 2: run items of all enabled sections
+        pending = {}
+        for section_key, section_cfg in status_config.items():
+            future = conditions.get(section_key)
+            if future is not None:
+                if not future.done():
+                    future.cancel()
                     continue
-
-                result[section_key] = {
-                    'title': section_cfg.get('title', section_key),
-                    'items': section_items
+                if not future.result():
+                    continue
+            pending[section_key] = [
+                self._submit_status_item(pool, (section_key, index), item, deadline)
+                for index, item in enumerate(section_cfg.get('items', []))
+            ]
+        wait([f for futures in pending.values() for f in futures if f],
+             timeout=max(0, deadline - time.monotonic()))
+
+        result = {}
+        for section_key, futures in pending.items():
+            section_cfg = status_config[section_key]
+            section_items = []
+            has_value = False
+            for item, future in zip(section_cfg.get('items', []), futures):
+                value, timed_out = None, False
+                if future is not None:
+                    if future.done():
+                        value, timed_out = future.result()
+                    else:
+                        future.cancel()
+                        timed_out = True
+                if value:
+                    has_value = True
+                entry = {
+                    'label': item.get('label', ''),
+                    'value': value
                 }
+                if timed_out:
+                    entry['timed_out'] = True
+                section_items.append(entry)
 
-            self.send_json(result)
+            if (section_cfg.get('if_cmd') or 'if_exists' in section_cfg) and not has_value:
+                continue
+
+            result[section_key] = {
+                'title': section_cfg.get('title', section_key),
+                'items': section_items
+            }
+
+        return result
+
+    def handle_status(self):
+        try:
+            self.send_json(self._collect_status())
         except Exception as e:
             log(f"Status error: {e}")
             self.send_error(500, str(e))
 
+    def handle_status_stream(self):
+        sub = self.status_sampler.subscribe()
+        try:
+            self._start_stream("text/event-stream", [("X-Accel-Buffering", "no")])
+
+            while True:
+                try:
+                    event, data = sub.queue.get(timeout=self.stream_keepalive)
+                except queue.Empty:
+                    self._write_stream_chunk(": keepalive\n\n")
+                    continue
+                self._write_stream_chunk(f"event: {event}\ndata: {json.dumps(data)}\n\n")
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        except Exception as e:
+            log(f"Status stream error: {e}")
+        finally:
+            self.status_sampler.unsubscribe(sub)
+
     def _get_setting_config(self, setting_key):
-        settings = self.functions.get('settings', {})
-        for group_key, group_cfg in settings.items():
-            items = group_cfg.get('items', {})
-            if setting_key in items:
-                return items[setting_key]
-        return None
+        return self.registry.settings.get(setting_key)
+
+    def _get_setting_value(self, config, name=None):
+        get_args = extended_config_get_args(config["get_cmd"])
+        if get_args and self.extended_config:
+            try:
+                return self.extended_config.get_value(*get_args)
+            except Exception:
+                return config.get("default", "")
+
+        def compute():
+            if not self.command_slots.acquire(timeout=5):
+                return config.get("default", "")
+            try:
+                returncode, stdout = self._run_timed('get', name or ' '.join(config["get_cmd"]), config["get_cmd"], 5)
+                return stdout.strip() if returncode == 0 else config.get("default", "")
+            except Exception:
+                return config.get("default", "")
+            finally:
+                self.command_slots.release()
+
+        return self.cache.get(cmd_cache_key('get', config["get_cmd"]), self._item_ttl(config), compute)
+
+    def _get_setting_values(self, setting_keys):
+        values = {}
+        for setting_key in setting_keys:
+            setting_config = self._get_setting_config(setting_key)
+            if setting_config:
+                values[setting_key] = self._get_setting_value(setting_config, setting_key)
+        return values
+
+    def _collect_settings(self, values):
+        result = {}
+        for group_key, group in self.registry.settings_catalog.items():
+            result[group_key] = {
+                "label": group["label"],
+                "items": [dict(item, current=values.get(item["id"])) for item in group["items"]]
+            }
+        return result
+
+    def _collect_links(self, values):
+        return [
+            link for condition, link in self.registry.links_catalog
+            if condition is None or values.get(condition["setting"]) == condition["value"]
+        ]
 
     def handle_get_settings(self):
         try:
-            settings = self.functions.get('settings', {})
-            result = {}
-            for group_key, group_cfg in settings.items():
-                group_label = group_cfg.get('label', group_key)
-                items = group_cfg.get('items', {})
-                settings_list = []
-                for setting_id, config in items.items():
-                    try:
-                        cmd_result = subprocess.run(
-                            config["get_cmd"],
-                            capture_output=True,
-                            text=True,
-                            timeout=5
-                        )
-                        current_value = cmd_result.stdout.strip() if cmd_result.returncode == 0 else config.get("default", "")
-                    except Exception:
-                        current_value = config.get("default", "")
-
-                    settings_list.append({
-                        "id": setting_id,
-                        "label": config["label"],
-                        "current": current_value,
-                        "options": {opt_key: opt_val["label"] for opt_key, opt_val in config["options"].items()}
-                    })
-                if settings_list:
-                    result[group_key] = {
-                        "label": group_label,
-                        "items": settings_list
-                    }
-
-            self.send_json(result)
+            values = self._get_setting_values(self.registry.setting_keys)
+            self.send_json(self._collect_settings(values))
         except Exception as e:
             log(f"Get settings error: {e}")
             self.send_error(500, str(e))
 
     def handle_get_links(self):
         try:
-            links = self.functions.get('links', {})
-            settings_cache = {}
-
-            for _, link_config in links.items():
-                condition = link_config.get("condition")
-                if condition:
-                    setting_key = condition["setting"]
-                    if setting_key not in settings_cache:
-                        setting_config = self._get_setting_config(setting_key)
-                        if setting_config:
-                            try:
-                                result = subprocess.run(
-                                    setting_config["get_cmd"],
-                                    capture_output=True,
-                                    text=True,
-                                    timeout=5
-                                )
-                                settings_cache[setting_key] = result.stdout.strip() if result.returncode == 0 else setting_config.get("default", "")
-                            except Exception:
-                                settings_cache[setting_key] = setting_config.get("default", "")
-
-            links_list = []
-            for _, link_config in links.items():
-                condition = link_config.get("condition")
-
-                if condition is None:
-                    links_list.append({
-                        "url": link_config["url"],
-                        "icon": link_config["icon"],
-                        "label": link_config["label"]
-                    })
-                else:
-                    setting_key = condition["setting"]
-                    required_value = condition["value"]
-                    current_value = settings_cache.get(setting_key)
-
-                    if current_value == required_value:
-                        links_list.append({
-                            "url": link_config["url"],
-                            "icon": link_config["icon"],
-                            "label": link_config["label"]
-                        })
-
-            self.send_json(links_list)
+            values = self._get_setting_values(self.registry.link_setting_keys)
+            self.send_json(self._collect_links(values))
         except Exception as e:
             log(f"Get links error: {e}")
             self.send_error(500, str(e))
 
     def _get_action_config(self, action_key):
-        actions = self.functions.get('actions', {})
-        for group_key, group_cfg in actions.items():
-            items = group_cfg.get('items', {})
-            if action_key in items:
-                return items[action_key]
-        return None
+        return self.registry.actions.get(action_key)
 
     def handle_get_actions(self):
         try:
-            actions_cfg = self.functions.get('actions', {})
-            result = {}
-            for group_key, group_cfg in actions_cfg.items():
-                group_label = group_cfg.get('label', group_key)
-                items = group_cfg.get('items', {})
-                actions_list = []
-                for action_id, cfg in items.items():
-                    actions_list.append({
-                        "id": action_id,
-                        "label": cfg.get("label", action_id),
-                        "confirm": cfg.get("confirm", False),
-                        "background": cfg.get("background", False),
-                        "download_file": cfg.get("download_file")
-                    })
-                if actions_list:
-                    result[group_key] = {
-                        "label": group_label,
-                        "items": actions_list
-                    }
-
-            self.send_json(result)
+            self.send_json_body(*self.registry.actions_response)
         except Exception as e:
             log(f"Get actions error: {e}")
             self.send_error(500, str(e))
 
+    def handle_bootstrap(self):
+        try:
+            registry = self.registry
+            values = self._get_setting_values(dict.fromkeys(registry.setting_keys + registry.link_setting_keys))
+            self.send_json({
+                "status": self._collect_status(),
+                "settings": self._collect_settings(values),
+                "links": self._collect_links(values),
+                "actions": registry.actions_catalog
+            })
+        except Exception as e:
+            log(f"Bootstrap error: {e}")
+            self.send_error(500, str(e))
+
+    def handle_metrics(self):
+        try:
+            body = METRICS.render()
+        except Exception as e:
+            log(f"Metrics error: {e}")
+            self.send_error(500, str(e))
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", len(body))
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def handle_get_jobs(self):
+        try:
+            self.send_json([job.to_dict() for job in self.jobs.list()])
+        except Exception as e:
+            log(f"Jobs error: {e}")
+            self.send_error(500, str(e))
+
+    def handle_get_job(self, job_id):
+        try:
+            job = self.jobs.get(job_id)
+            if not job:
+                self.send_error(404, f"Unknown job: {job_id}")
+                return
+            self.send_json(job.to_dict())
+        except Exception as e:
+            log(f"Job error: {e}")
+            self.send_error(500, str(e))
+
+    def handle_job_log(self, job_id, query):
+        try:
+            job = self.jobs.get(job_id)
+            if not job:
+                self.send_error(404, f"Unknown job: {job_id}")
+                return
+            params = parse_qs(query)
+            try:
+                offset = max(0, int(params.get("offset", ["0"])[0]))
+            except ValueError:
+                self.send_error(400, "Invalid offset")
+                return
+            follow = params.get("follow", ["1"])[0] != "0"
+            self._stream_job(job, offset, follow)
+        except Exception as e:
+            log(f"Job log error: {e}")
+            self.send_error(500, str(e))
+
     def handle_update_setting(self, setting_key, value):
-        stream_started = False
         try:
             config = self._get_setting_config(setting_key)
             if not config:
@@ -410,43 +2431,46 @@ class FirmwareConfigHandler(SimpleHTTPRequestHandler):
                 return
 
             option_config = config["options"][value]
+            cache_key = cmd_cache_key('get', config["get_cmd"])
 
-            log(f"Updating setting {setting_key} to {value}")
+            job = self._create_job("setting", f"{config['label']}: {option_config['label']}")
+            if not job:
+                return
 
-            self._start_text_stream()
-            stream_started = True
+            def work(job):
+                log(f"Updating setting {setting_key} to {value}")
+                self.cache.invalidate(cache_key)
 
-            self._write_stream_chunk(f"=== Updating {config['label']} ===\n")
-            self._write_stream_chunk(f"Setting: {option_config['label']}\n")
-            self._write_stream_chunk(f"Time: {time.strftime('%Y-%m-%d %H:%M:%S')}\n")
-            self._write_stream_chunk(f"{'=' * 40}\n\n")
+                job.write(f"=== Updating {config['label']} ===\n")
+                job.write(f"Setting: {option_config['label']}\n")
+                job.write(f"Time: {time.strftime('%Y-%m-%d %H:%M:%S')}\n")
+                job.write(f"{'=' * 40}\n\n")
 
-            # Execute the command for this option
-            self._write_stream_chunk(f"Applying changes...\n")
-            rc, _ = self._stream_command(option_config["cmd"])
+                # Execute the command for this option
+                job.write(f"Applying changes...\n")
+                try:
+                    rc, _ = job.run_command(option_config["cmd"])
+                finally:
+                    self.cache.invalidate(cache_key)
 
-            self._write_stream_chunk(f"\n{'=' * 40}\n")
-            if rc == 0:
-                self._write_stream_chunk(f"SUCCESS: Setting updated successfully\n")
-            else:
-                self._write_stream_chunk(f"ERROR: Command completed with exit code {rc}\n")
-            self._finish_text_stream()
+                job.write(f"\n{'=' * 40}\n")
+                if rc == 0:
+                    job.write(f"SUCCESS: Setting updated successfully\n")
+                else:
+                    job.write(f"ERROR: Command completed with exit code {rc}\n")
+                return rc
 
+            self.jobs.start(job, work)
+            self._stream_job(job)
         except Exception as e:
             log(f"Update setting error: {e}")
             try:
-                if stream_started:
-                    try:
-                        self._write_stream_chunk(f"\nError: {e}\n")
-                        self._finish_text_stream()
-                    except Exception:
-                        pass
-                else:
-                    self.send_error(500, str(e))
+                self.send_error(500, str(e))
             except Exception:
                 pass
 
-    def stream_multipart_to_file(self, field_name, target_path):
+    def stream_multipart_to_file(self, field_name, target_path, validator=None):
+        """Stream the multipart field to target_path, returns (path, size, sha256)."""
         content_type = self.headers.get("Content-Type", "")
         content_length = int(self.headers.get("Content-Length", 0))
         boundary = None
@@ -456,8 +2480,7 @@ class FirmwareConfigHandler(SimpleHTTPRequestHandler):
                 boundary = part[9:].strip('"')
                 break
         if not boundary or content_length == 0:
-            return None, 0
-        boundary_bytes = f"--{boundary}".encode()
+            return None, 0, None
         os.makedirs(os.path.dirname(target_path), exist_ok=True)
         try:
             os.unlink(target_path)
@@ -466,44 +2489,34 @@ class FirmwareConfigHandler(SimpleHTTPRequestHandler):
         tf = open(target_path, "wb")
         try:
             fcntl.flock(tf, fcntl.LOCK_EX)
-            in_file_content = False
+            reader = MultipartReader(self.rfile, boundary, content_length)
+            found = False
             file_size = 0
-            buf = b""
-            chunk_size = 64 * 1024
-            remaining = content_length
-            while remaining > 0:
-                read_size = min(chunk_size, remaining)
-                chunk = self.rfile.read(read_size)
-                if not chunk:
+            digest = hashlib.sha256()
+
+            def write(data):
+                if validator:
+                    validator.feed(data)
+                tf.write(data)
+                digest.update(data)
+                METRICS.inc("firmware_config_streamed_bytes_total", len(data), direction="upload")
+
+            while True:
+                headers = reader.next_part()
+                if headers is None:
                     break
-                remaining -= len(chunk)
-                buf += chunk
-                if not in_file_content:
-                    header_end = buf.find(b"\r\n\r\n")
-                    if header_end != -1:
-                        header_part = buf[:header_end]
-                        if field_name.encode() in header_part:
-                            in_file_content = True
-                            buf = buf[header_end + 4:]
-                        else:
-                            buf = buf[header_end + 4:]
-                if in_file_content:
-                    end_pos = buf.find(boundary_bytes)
-                    if end_pos != -1:
-                        data = buf[:end_pos]
-                        if data.endswith(b"\r\n"):
-                            data = data[:-2]
-                        tf.write(data)
-                        file_size += len(data)
-                        break
-                    else:
-                        safe_len = len(buf) - len(boundary_bytes) - 4
-                        if safe_len > 0:
-                            tf.write(buf[:safe_len])
-                            file_size += safe_len
-                            buf = buf[safe_len:]
+                if not found and multipart_field_name(headers) == field_name:
+                    file_size = reader.read_part(write)
+                    found = True
+                    if validator:
+                        validator.finish()
+                else:
+                    reader.read_part(None)
             tf.close()
-            return target_path, file_size
+            if not found:
+                os.unlink(target_path)
+                return None, 0, None
+            return target_path, file_size, digest.hexdigest()
         except Exception:
             tf.close()
             try:
@@ -513,15 +2526,15 @@ class FirmwareConfigHandler(SimpleHTTPRequestHandler):
             raise
 
     def handle_upgrade_url(self):
-        cfg = self.functions.get('upgrade_url', {})
+        cfg = self.registry.functions.get('upgrade_url', {})
         if not cfg:
             self.send_error(404, "URL upgrade not configured")
             return
 
         shell_template = cfg.get('shell')
         stop_token = cfg.get('stop_token')
+        download_path = cfg.get('download_path')
 
-        stream_started = False
         try:
             content_length = int(self.headers.get("Content-Length", 0))
             if content_length == 0:
@@ -532,7 +2545,8 @@ class FirmwareConfigHandler(SimpleHTTPRequestHandler):
             try:
                 data = json.loads(body)
                 url = data.get('url', '').strip()
-            except json.JSONDecodeError:
+                expected_sha256 = (data.get('sha256') or '').strip().lower()
+            except (json.JSONDecodeError, AttributeError):
                 self.send_error(400, "Invalid JSON")
                 return
 
@@ -540,34 +2554,76 @@ class FirmwareConfigHandler(SimpleHTTPRequestHandler):
                 self.send_error(400, "Missing 'url' parameter")
                 return
 
-            log(f"Upgrade from URL: {url}")
-            self._start_text_stream()
-            stream_started = True
-            self._write_stream_chunk(f"=== Upgrade Started ===\n")
-            self._write_stream_chunk(f"URL: {url}\n")
-            self._write_stream_chunk(f"Time: {time.strftime('%Y-%m-%d %H:%M:%S')}\n")
-            self._write_stream_chunk(f"{'=' * 40}\n\n")
-
-            rc, stopped = self._stream_command(shell_to_cmd(shell_template, url), stop_token=stop_token)
-            self._write_stream_chunk(f"\n{'=' * 40}\n")
-            if rc == 0 or stopped:
-                self._write_stream_chunk("SUCCESS: Completed successfully.\n")
-            else:
-                self._write_stream_chunk(f"ERROR: Failed with exit code {rc}\n")
-            self._finish_text_stream()
+            if download_path and urlparse(url).scheme not in ("http", "https"):
+                self.send_error(400, "Only http and https URLs are supported")
+                return
+
+            job = self._create_job("upgrade", f"Upgrade from {url}")
+            if not job:
+                return
+
+            def work(job):
+                log(f"Upgrade from URL: {url}")
+                job.write(f"=== Upgrade Started ===\n")
+                job.write(f"URL: {url}\n")
+                job.write(f"Time: {time.strftime('%Y-%m-%d %H:%M:%S')}\n")
+                job.write(f"{'=' * 40}\n\n")
+
+                if not download_path:
+                    rc, stopped = job.run_command(shell_to_cmd(shell_template, url), stop_token=stop_token)
+                else:
+                    rc, stopped = self._download_and_upgrade(job, cfg, url, expected_sha256, download_path)
+
+                job.write(f"\n{'=' * 40}\n")
+                if rc == 0 or stopped:
+                    job.write("SUCCESS: Completed successfully.\n")
+                    return 0
+                job.write(f"ERROR: Failed with exit code {rc}\n")
+                return rc
+
+            self.jobs.start(job, work)
+            self._stream_job(job)
         except Exception as e:
             log(f"Upgrade URL error: {e}")
             try:
-                if stream_started:
-                    self._write_stream_chunk(f"\nError: {e}\n")
-                    self._finish_text_stream()
-                else:
-                    self.send_error(500, str(e))
+                self.send_error(500, str(e))
             except Exception:
                 pass
 
+    @staticmethod
+    def _download_and_upgrade(job, cfg, url, expected_sha256, download_path):
+        check_shell = cfg.get('check_shell')
+        if check_shell:
+            rc, _ = job.run_command(shell_to_cmd(check_shell, url))
+            if rc != 0:
+                return rc, False
+
+        job.write("Downloading upgrade...\n")
+        validator = FirmwareImageValidator() if cfg.get('validate_image') else None
+        try:
+            size, sha256 = download_with_resume(url, download_path,
+                                                progress=lambda *args: job.write(format_progress(*args)),
+                                                validator=validator, retries=int(cfg.get('retries', 5)))
+        except (DownloadError, FirmwareImageError) as e:
+            log(f"Download failed: {e}")
+            job.write(f"Failed to download upgrade file: {e}\n")
+            return 1, False
+
+        log(f"Downloaded: {download_path} ({size} bytes, SHA256: {sha256})")
+        job.write(f"Size: {size} bytes\n")
+        job.write(f"SHA256: {sha256}\n")
+        if validator:
+            job.write(f"Image version: {validator.version}\n")
+        if expected_sha256 and expected_sha256 != sha256:
+            job.write(f"SHA256 mismatch, expected {expected_sha256}\n")
+            os.unlink(download_path)
+            return 1, False
+
+        job.write("Download complete. Starting upgrade...\n")
+        return job.run_command(shell_to_cmd(cfg.get('shell'), download_path), stop_token=cfg.get('stop_token'))
+
     def handle_upgrade_upload(self):
-        cfg = self.functions.get('upgrade_upload', {})
+        cfg = self.registry.functions.get('upgrade_upload', {})
         if not cfg:
             self.send_error(404, "Upload upgrade not configured")
             return
@@ -576,54 +2632,145 @@ class FirmwareConfigHandler(SimpleHTTPRequestHandler):
         shell_template = cfg.get('shell')
         stop_token = cfg.get('stop_token')
 
-        stream_started = False
-        file_path = None
+        job = None
         try:
             content_type = self.headers.get("Content-Type", "")
             if "multipart/form-data" not in content_type:
                 self.send_error(400, "Expected multipart/form-data")
                 return
 
-            file_path, file_size = self.stream_multipart_to_file("file", upload_path)
+            # Claim the upgrade slot before receiving the file
+            job = self._create_job("upgrade", "Upgrade from uploaded file")
+            if not job:
+                self.close_connection = True
+                return
+
+            validator = None
+            if cfg.get('validate_image'):
+                validator = FirmwareImageValidator(int(self.headers.get("Content-Length", 0)))
+            try:
+                file_path, file_size, file_sha256 = self.stream_multipart_to_file("file", upload_path, validator)
+            except FirmwareImageError as e:
+                log(f"Upload rejected: {e}")
+                job.write(f"Invalid firmware image: {e}\n")
+                self.jobs.finish(job, 1)
+                # Stop receiving the rest of the body
+                self.close_connection = True
+                self.send_error(400, f"Invalid firmware image: {e}")
+                return
             if not file_path:
+                job.write("No file in request\n")
+                self.jobs.finish(job, 1)
                 self.send_error(400, "No file in request")
                 return
 
-            log(f"Uploaded: {file_path} ({file_size} bytes)")
-            self._start_text_stream()
-            stream_started = True
-            self._write_stream_chunk(f"=== Upgrade Started ===\n")
-            self._write_stream_chunk(f"File: {file_path}\n")
-            self._write_stream_chunk(f"Size: {file_size} bytes\n")
-            self._write_stream_chunk(f"Time: {time.strftime('%Y-%m-%d %H:%M:%S')}\n")
-            self._write_stream_chunk(f"{'=' * 40}\n\n")
+            log(f"Uploaded: {file_path} ({file_size} bytes, SHA256: {file_sha256})")
+
+            def work(job):
+                job.write(f"=== Upgrade Started ===\n")
+                job.write(f"File: {file_path}\n")
+                job.write(f"Size: {file_size} bytes\n")
+                job.write(f"SHA256: {file_sha256}\n")
+                if validator:
+                    job.write(f"Image version: {validator.version}\n")
+                job.write(f"Time: {time.strftime('%Y-%m-%d %H:%M:%S')}\n")
+                job.write(f"{'=' * 40}\n\n")
 
-            try:
-                rc, stopped = self._stream_command(shell_to_cmd(shell_template, file_path), stop_token=stop_token)
-                self._write_stream_chunk(f"\n{'=' * 40}\n")
-                if rc == 0 or stopped:
-                    self._write_stream_chunk("SUCCESS: Completed successfully.\n")
-                else:
-                    self._write_stream_chunk(f"ERROR: Failed with exit code {rc}\n")
-            except Exception as e:
-                self._write_stream_chunk(f"\nError: {e}\n")
-            finally:
                 try:
-                    os.unlink(file_path)
-                except Exception:
-                    pass
-            self._finish_text_stream()
+                    rc, stopped = job.run_command(shell_to_cmd(shell_template, file_path), stop_token=stop_token)
+                    job.write(f"\n{'=' * 40}\n")
+                    if rc == 0 or stopped:
+                        job.write("SUCCESS: Completed successfully.\n")
+                        return 0
+                    job.write(f"ERROR: Failed with exit code {rc}\n")
+                    return rc
+                finally:
+                    try:
+                        os.unlink(file_path)
+                    except Exception:
+                        pass
+
+            self.jobs.start(job, work)
+            started, job = job, None
+            self._stream_job(started)
         except Exception as e:
             log(f"Upgrade upload error: {e}")
+            if job:
+                job.write(f"\nError: {e}\n")
+                self.jobs.finish(job, 1)
             try:
-                if stream_started:
-                    self._write_stream_chunk(f"\nError: {e}\n")
-                    self._finish_text_stream()
-                else:
-                    self.send_error(500, str(e))
+                self.send_error(500, str(e))
             except Exception:
                 pass
 
+class FirmwareConfigServer(ThreadingHTTPServer):
+    """ThreadingHTTPServer with a cap on open connections, each of which holds a thread.
+
+    At the cap, the connection that has waited longest for its next
+    request is closed to admit the new one. If every connection is
+    handling a request, the new one is answered with 503.
+    """
+
+    BUSY_RESPONSE = (b"HTTP/1.1 503 Service Unavailable\r\nRetry-After: 1\r\n"
+                     b"Content-Length: 0\r\nConnection: close\r\n\r\n")
+
+    def __init__(self, address, handler_cls, max_connections=64):
+        self.max_connections = max_connections
+        # Open connections: idle since (monotonic time), or None while handling a request
+        self._connections = {}
+        self._connections_lock = threading.Lock()
+        super().__init__(address, handler_cls)
+
+    @property
+    def connection_count(self):
+        return len(self._connections)
+
+    def connection_idle(self, request, idle):
+        with self._connections_lock:
+            if request in self._connections:
+                self._connections[request] = time.monotonic() if idle else None
+
+    def process_request(self, request, client_address):
+        with self._connections_lock:
+            reclaim = None
+            if len(self._connections) >= self.max_connections:
+                idle = [(since, sock) for sock, since in self._connections.items() if since is not None]
+                if idle:
+                    reclaim = min(idle, key=lambda entry: entry[0])[1]
+                    del self._connections[reclaim]
+            admitted = len(self._connections) < self.max_connections
+            if admitted:
+                self._connections[request] = time.monotonic()
+
+        if reclaim is not None:
+            METRICS.inc("firmware_config_connections_reclaimed_total")
+            try:
+                # Wakes up its thread, which is waiting for the next request line
+                reclaim.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        if not admitted:
+            log(f"Busy: rejecting connection from {client_address[0]}")
+            METRICS.inc("firmware_config_connections_rejected_total")
+            try:
+                request.setblocking(False)
+                # Read what the client already sent, so closing does not reset the 503
+                request.recv(65536)
+            except OSError:
+                pass
+            try:
+                request.send(self.BUSY_RESPONSE)
+            except OSError:
+                pass
+            self.shutdown_request(request)
+            return
+        super().process_request(request, client_address)
+
+    def shutdown_request(self, request):
+        with self._connections_lock:
+            self._connections.pop(request, None)
+        super().shutdown_request(request)
+
 def main():
     script_dir = os.path.dirname(os.path.abspath(__file__))
     local_html_dir = os.path.join(script_dir, "html")
@@ -648,18 +2795,58 @@ def main():
     parser.add_argument("--bind", default="0.0.0.0", help="Bind address")
     parser.add_argument("--html-dir", default=default_html_dir, help="Path to HTML directory")
     parser.add_argument("--functions-dir", default=default_functions_dir, help="Path to directory containing YAML function files (loaded in sorted order)")
+    parser.add_argument("--functions-cache", default=None, help="JSON cache of the merged functions (default: functions.cache.json next to the functions directory, 'none' to disable)")
+    parser.add_argument("--generate-cache", action="store_true", help="Write the functions cache and exit")
+    parser.add_argument("--status-workers", type=int, default=4, help="Number of parallel workers for status commands")
+    parser.add_argument("--status-deadline", type=float, default=5.0, help="Overall deadline in seconds for a single /api/status request")
+    parser.add_argument("--stream-interval", type=float, default=5.0, help="Default sampling interval in seconds for /api/status/stream (per item: interval)")
+    parser.add_argument("--max-commands", type=int, default=8, help="Maximum number of commands running at the same time")
+    parser.add_argument("--max-connections", type=int, default=64, help="Maximum number of open connections, each holds a thread")
+    parser.add_argument("--job-log-size", type=int, default=128, help="Output kept per job in KB, older output is dropped")
+    parser.add_argument("--job-history", type=int, default=8, help="Number of finished jobs kept for reattaching")
+    parser.add_argument("--cache-ttl", type=float, default=5.0, help="Default cache TTL in seconds for status and setting commands (per item: cache_ttl)")
     args = parser.parse_args()
 
     if not os.path.isdir(args.functions_dir):
         log(f"ERROR: Functions directory not found: {args.functions_dir}")
         return 1
 
-    functions = load_functions_from_dir(args.functions_dir)
+    cache_path = args.functions_cache
+    if cache_path is None:
+        cache_path = os.path.join(os.path.dirname(os.path.abspath(args.functions_dir)), "functions.cache.json")
+    elif cache_path == "none":
+        cache_path = None
+    registry = load_functions_from_dir(args.functions_dir, cache_path, use_cache=not args.generate_cache)
+    if args.generate_cache:
+        if registry.errors or not cache_path:
+            log(f"ERROR: Functions cache not generated")
+            return 1
+        log(f"Functions cache written: {cache_path}")
+        return 0
+    functions = registry.functions
+    registry.load_static_status()
 
     FirmwareConfigHandler.html_dir = os.fspath(args.html_dir)
-    FirmwareConfigHandler.functions = functions
-
-    server = ThreadingHTTPServer((args.bind, args.port), FirmwareConfigHandler)
+    FirmwareConfigHandler.static_assets = StaticAssets(FirmwareConfigHandler.html_dir)
+    FirmwareConfigHandler.registry = registry
+    FirmwareConfigHandler.functions_dir = args.functions_dir
+    FirmwareConfigHandler.functions_cache = cache_path
+    FirmwareConfigHandler.status_pool = ThreadPoolExecutor(max_workers=max(1, args.status_workers), thread_name_prefix="status")
+    FirmwareConfigHandler.status_deadline = args.status_deadline
+    FirmwareConfigHandler.cache_ttl = args.cache_ttl
+    FirmwareConfigHandler.extended_config = load_extended_config()
+    FirmwareConfigHandler.status_sampler = StatusSampler(FirmwareConfigHandler, args.stream_interval)
+    FirmwareConfigHandler.command_slots = threading.BoundedSemaphore(max(1, args.max_commands))
+    FirmwareConfigHandler.jobs = JobManager(FirmwareConfigHandler.jobs.limits, args.job_log_size * 1024, args.job_history,
+                                            FirmwareConfigHandler.command_slots)
+
+    METRICS.gauge("firmware_config_threads", "Active threads", threading.active_count)
+    METRICS.gauge("firmware_config_jobs_running", "Running jobs by type", lambda: [
+        ({"kind": kind}, sum(1 for job in FirmwareConfigHandler.jobs.list() if job.kind == kind and job.state == "running"))
+        for kind in FirmwareConfigHandler.jobs.limits])
+
+    server = FirmwareConfigServer((args.bind, args.port), FirmwareConfigHandler, max(1, args.max_connections))
+    METRICS.gauge("firmware_config_connections", "Open connections", lambda: server.connection_count)
     log(f"Firmware Tool Control Server running on http://{args.bind}:{args.port}")
     log(f"  HTML directory: {args.html_dir}")
     log(f"  Functions dir: {args.functions_dir}")
@@ -667,18 +2854,26 @@ def main():
     log(f"Available endpoints:")
     log(f"  GET  /                         - Web interface")
     log(f"  GET  /api/status               - System and network information")
+    log(f"  GET  /api/status/stream        - Stream status changes (Server-Sent Events)")
     log(f"  GET  /api/settings             - Get current settings")
     log(f"  GET  /api/links                - Get available quick links")
     log(f"  GET  /api/actions              - Get available actions")
+    log(f"  GET  /api/bootstrap            - Get status, settings, links and actions at once")
+    log(f"  GET  /api/jobs                 - List running and recent jobs")
+    log(f"  GET  /api/jobs/<id>/log        - Stream job output (?offset=N, follow=0)")
+    log(f"  GET  /metrics                  - Request, command and transfer metrics (Prometheus)")
     log(f"  POST /api/upgrade                   - Upload file or download from URL and install firmware")
     log(f"  POST /api/settings/<option>/<value> - Update a setting")
     log(f"  POST /api/action/<action>           - Execute action")
     log(f"  POST /api/action/<action>/download  - Download action result file")
+    log(f"  GET  /api/action/<action>/download  - Download action result file (resumable with Range)")
     log(f"")
     log(f"Available actions: {', '.join(functions.get('actions', {}).keys())}")
     log(f"Available settings: {', '.join(functions.get('settings', {}).keys())}")
     log(f"Available links: {', '.join(functions.get('links', {}).keys())}")
 
+    FunctionsWatcher(args.functions_dir, FirmwareConfigHandler.reload_functions).start()
+
     try:
         server.serve_forever()
     except KeyboardInterrupt:
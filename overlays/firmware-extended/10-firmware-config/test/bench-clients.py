@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+
+# Concurrent client benchmark for firmware-config.py.
+#
+# Starts firmware-config.py with a throwaway functions directory, opens a
+# mix of status streams, idle keep-alive connections and /api/status
+# pollers, and reports RSS, thread count and responses. Requests above the
+# per-endpoint limits are answered with 503, connections above
+# --max-connections reclaim an idle keep-alive connection or get a 503:
+#
+#   ./bench-clients.py --clients 50
+#   ./bench-clients.py --clients 150 --server-args '--max-connections 32'
+
+import argparse
+import http.client
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+DEFAULT_SERVER = os.path.join(ROOT_DIR, "root/usr/local/bin/firmware-config.py")
+
+STATUS_YAML = """
+status:
+  system:
+    title: System
+    items:
+      - label: Uptime
+        cmd: cut -d' ' -f1 /proc/uptime
+        interval: 1
+      - label: Load
+        cmd: cat /proc/loadavg
+        interval: 1
+"""
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def wait_for_port(port, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            return True
+        except OSError:
+            time.sleep(0.05)
+    return False
+
+def proc_status(pid):
+    values = {}
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            key, _, value = line.partition(":")
+            if key in ("VmRSS", "VmHWM", "Threads"):
+                values[key] = int(value.split()[0])
+    return values
+
+def stream_client(port, stop, stats):
+    sock = socket.create_connection(("127.0.0.1", port))
+    sock.sendall(b"GET /api/status/stream HTTP/1.1\r\nHost: bench\r\n\r\n")
+    sock.settimeout(0.5)
+    while not stop.is_set():
+        try:
+            data = sock.recv(65536)
+        except socket.timeout:
+            continue
+        if not data:
+            break
+        stats["stream_bytes"] += len(data)
+    sock.close()
+
+def idle_client(port, stop, stats):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    try:
+        conn.request("GET", "/api/actions")
+        resp = conn.getresponse()
+        resp.read()
+        stats[resp.status] = stats.get(resp.status, 0) + 1
+    except (OSError, http.client.HTTPException):
+        stats["errors"] += 1
+    stop.wait()
+    conn.close()
+
+def poll_client(port, stop, stats):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    while not stop.is_set():
+        try:
+            conn.request("GET", "/api/status")
+            resp = conn.getresponse()
+            resp.read()
+            stats[resp.status] = stats.get(resp.status, 0) + 1
+            if resp.will_close:
+                conn.close()
+        except (OSError, http.client.HTTPException):
+            stats["errors"] += 1
+            conn.close()
+        stop.wait(0.2)
+    conn.close()
+
+def run(server_path, clients, duration, server_args=()):
+    with tempfile.TemporaryDirectory() as tmp:
+        functions_dir = os.path.join(tmp, "functions")
+        os.makedirs(functions_dir)
+        with open(os.path.join(functions_dir, "01_status.yaml"), "w") as f:
+            f.write(STATUS_YAML)
+
+        port = free_port()
+        server = subprocess.Popen(
+            [sys.executable, server_path, "--bind", "127.0.0.1", "--port", str(port),
+             "--html-dir", tmp, "--functions-dir", functions_dir, *server_args],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            if not wait_for_port(port):
+                print("ERROR: server did not start", file=sys.stderr)
+                return None
+
+            stop = threading.Event()
+            stats = {"stream_bytes": 0, "errors": 0, 200: 0, 503: 0}
+            kinds = [stream_client, idle_client, poll_client]
+            threads = [threading.Thread(target=kinds[i % len(kinds)], args=(port, stop, stats), daemon=True)
+                       for i in range(clients)]
+            for thread in threads:
+                thread.start()
+
+            peak = {"VmRSS": 0, "Threads": 0}
+            deadline = time.monotonic() + duration
+            while time.monotonic() < deadline:
+                current = proc_status(server.pid)
+                peak = {key: max(peak[key], current[key]) for key in peak}
+                time.sleep(0.2)
+            final = proc_status(server.pid)
+            stop.set()
+            for thread in threads:
+                thread.join(timeout=2)
+
+            return {"rss_kb": peak["VmRSS"], "hwm_kb": final["VmHWM"], "threads": peak["Threads"], **stats}
+        finally:
+            server.terminate()
+            server.wait()
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure firmware-config.py under concurrent clients")
+    parser.add_argument("--server", default=DEFAULT_SERVER, help="Path to firmware-config.py")
+    parser.add_argument("--clients", type=int, default=50, help="Number of concurrent clients (streams, idle and pollers)")
+    parser.add_argument("--duration", type=float, default=10, help="Seconds to keep the clients connected")
+    parser.add_argument("--server-args", default="", help="Extra arguments for the server, e.g. '--max-connections 32'")
+    args = parser.parse_args()
+
+    result = run(args.server, args.clients, args.duration, args.server_args.split())
+    if not result:
+        return 1
+    print(f"{'clients':>8} {'peak RSS':>10} {'VmHWM':>10} {'threads':>8} {'200':>6} {'503':>6} {'errors':>7} {'stream':>10}")
+    print(f"{args.clients:>8} {result['rss_kb']:>7} kB {result['hwm_kb']:>7} kB {result['threads']:>8} "
+          f"{result[200]:>6} {result[503]:>6} {result['errors']:>7} {result['stream_bytes']:>9}B")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+
+# Offline load test for firmware-config.py.
+#
+# Starts firmware-config.py against the functions in fixtures/functions, whose
+# commands are deterministic stubs (fast, slow, failing and large output), so
+# no printer, /home/lava or systemUpgrade.sh is needed. Each scenario is run
+# with the given concurrency and the results are printed as JSON:
+#
+#   ./bench-load.py --requests 200 --concurrency 8 > after.json
+#   git show HEAD~1:overlays/firmware-extended/10-firmware-config/root/usr/local/bin/firmware-config.py > /tmp/old.py
+#   ./bench-load.py --server /tmp/old.py > before.json
+#
+# Setting updates, actions and uploads are jobs limited per type by the
+# server, they run with --write-concurrency and 409 answers are counted.
+
+import argparse
+import collections
+import http.client
+import json
+import math
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.join(TEST_DIR, "..")
+DEFAULT_SERVER = os.path.join(ROOT_DIR, "root/usr/local/bin/firmware-config.py")
+FIXTURES_DIR = os.path.join(TEST_DIR, "fixtures")
+
+SCENARIOS = ["status", "settings", "links", "actions", "setting-update", "action", "upload"]
+WRITE_SCENARIOS = ("setting-update", "action", "upload")
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def wait_for_port(port, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            return True
+        except OSError:
+            time.sleep(0.05)
+    return False
+
+def proc_status(pid):
+    values = {}
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key in ("VmRSS", "VmHWM", "Threads"):
+                    values[key] = int(value.split()[0])
+    except OSError:
+        pass
+    return values
+
+def prepare_functions(work_dir):
+    """Copy the fixtures to work_dir, filling in the stub and work paths."""
+    stub = os.path.join(work_dir, "stub.sh")
+    shutil.copy2(os.path.join(FIXTURES_DIR, "stub.sh"), stub)
+    functions_dir = os.path.join(work_dir, "functions")
+    os.makedirs(functions_dir)
+    for name in sorted(os.listdir(os.path.join(FIXTURES_DIR, "functions"))):
+        with open(os.path.join(FIXTURES_DIR, "functions", name)) as f:
+            content = f.read()
+        with open(os.path.join(functions_dir, name), "w") as f:
+            f.write(content.replace("@STUB@", stub).replace("@WORK@", work_dir))
+    return functions_dir
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    # Nearest-rank percentile
+    index = max(0, math.ceil(p / 100 * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+def multipart_body(boundary, size_kb):
+    data = bytes(range(256)) * (size_kb * 4)
+    head = (f"--{boundary}\r\n"
+            f'Content-Disposition: form-data; name="file"; filename="firmware.bin"\r\n'
+            f"Content-Type: application/octet-stream\r\n\r\n").encode()
+    tail = f"\r\n--{boundary}--\r\n".encode()
+    return head + data + tail
+
+def make_requests(args):
+    """Return scenario name -> function(index) returning (method, path, body, headers)."""
+    boundary = "benchboundary" + os.urandom(8).hex()
+    upload = multipart_body(boundary, args.upload_kb)
+    upload_headers = {"Content-Type": f"multipart/form-data; boundary={boundary}"}
+    values = ["paxx12", "snapmaker"]
+    return {
+        "status": lambda i: ("GET", "/api/status", None, {}),
+        "settings": lambda i: ("GET", "/api/settings", None, {}),
+        "links": lambda i: ("GET", "/api/links", None, {}),
+        "actions": lambda i: ("GET", "/api/actions", None, {}),
+        "setting-update": lambda i: ("POST", f"/api/settings/camera-stack/{values[i % 2]}", b"", {}),
+        "action": lambda i: ("POST", "/api/action/verbose", b"", {}),
+        "upload": lambda i: ("POST", "/api/upgrade/upload", upload, upload_headers),
+    }
+
+def run_scenario(port, request, count, concurrency):
+    latencies = []
+    codes = collections.Counter()
+    lock = threading.Lock()
+    next_index = iter(range(count))
+    received = [0]
+
+    def client():
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+        while True:
+            with lock:
+                index = next(next_index, None)
+            if index is None:
+                break
+            method, path, body, headers = request(index)
+            start = time.monotonic()
+            try:
+                conn.request(method, path, body=body, headers=headers)
+                resp = conn.getresponse()
+                size = len(resp.read())
+                code = resp.status
+                if resp.will_close:
+                    conn.close()
+            except (OSError, http.client.HTTPException):
+                size = 0
+                code = "error"
+                conn.close()
+            elapsed = time.monotonic() - start
+            with lock:
+                latencies.append(elapsed)
+                codes[code] += 1
+                received[0] += size
+        conn.close()
+
+    threads = [threading.Thread(target=client, daemon=True) for _ in range(max(1, concurrency))]
+    start = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - start
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "concurrency": concurrency,
+        "seconds": round(elapsed, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 1) if elapsed > 0 else None,
+        "latency_ms": {
+            name: round(percentile(latencies, p) * 1000, 2) if latencies else None
+            for name, p in (("p50", 50), ("p95", 95), ("p99", 99))
+        },
+        "latency_max_ms": round(latencies[-1] * 1000, 2) if latencies else None,
+        "codes": {str(code): n for code, n in sorted(codes.items(), key=str)},
+        "bytes_received": received[0],
+    }
+
+def read_spawns(spawn_log):
+    try:
+        with open(spawn_log) as f:
+            return collections.Counter(line.strip() for line in f)
+    except FileNotFoundError:
+        return collections.Counter()
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline load test for firmware-config.py, results as JSON")
+    parser.add_argument("--server", default=DEFAULT_SERVER, help="Path to firmware-config.py")
+    parser.add_argument("--server-args", default="", help="Extra arguments for the server, e.g. '--max-commands 4'")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help=f"Comma separated scenarios ({', '.join(SCENARIOS)})")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per read scenario")
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent clients for read scenarios")
+    parser.add_argument("--write-requests", type=int, default=10, help="Requests per setting update, action and upload scenario")
+    parser.add_argument("--write-concurrency", type=int, default=1, help="Concurrent clients for setting updates, actions and uploads")
+    parser.add_argument("--upload-kb", type=int, default=4096, help="Size of the uploaded file in KB")
+    parser.add_argument("--output", help="Write the JSON results to this file instead of stdout")
+    args = parser.parse_args()
+
+    scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = [name for name in scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(unknown)}")
+
+    with tempfile.TemporaryDirectory(prefix="bench-load-") as work_dir:
+        functions_dir = prepare_functions(work_dir)
+        state_dir = os.path.join(work_dir, "state")
+        os.makedirs(state_dir)
+        spawn_log = os.path.join(work_dir, "spawns.log")
+        env = dict(os.environ, BENCH_SPAWN_LOG=spawn_log, BENCH_STATE_DIR=state_dir)
+
+        server_args = ["--html-dir", work_dir, "--functions-dir", functions_dir]
+        with open(args.server) as f:
+            # Older revisions have no functions cache, keep them comparable
+            if "--functions-cache" in f.read():
+                server_args += ["--functions-cache", "none"]
+
+        port = free_port()
+        server = subprocess.Popen(
+            [sys.executable, args.server, "--bind", "127.0.0.1", "--port", str(port)]
+            + server_args + args.server_args.split(),
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, env=env)
+        try:
+            if not wait_for_port(port):
+                print("ERROR: server did not start", file=sys.stderr)
+                return 1
+
+            requests = make_requests(args)
+            peak_threads = [proc_status(server.pid).get("Threads", 0)]
+            stop = threading.Event()
+
+            def sample():
+                while not stop.wait(0.1):
+                    peak_threads[0] = max(peak_threads[0], proc_status(server.pid).get("Threads", 0))
+
+            sampler = threading.Thread(target=sample, daemon=True)
+            sampler.start()
+
+            results = {}
+            for name in scenarios:
+                before = sum(read_spawns(spawn_log).values())
+                if name in WRITE_SCENARIOS:
+                    result = run_scenario(port, requests[name], args.write_requests, args.write_concurrency)
+                else:
+                    result = run_scenario(port, requests[name], args.requests, args.concurrency)
+                result["subprocesses"] = sum(read_spawns(spawn_log).values()) - before
+                results[name] = result
+                print(f"{name}: {result['requests']} requests, p50 {result['latency_ms']['p50']} ms, "
+                      f"{result['throughput_rps']} req/s", file=sys.stderr)
+
+            stop.set()
+            sampler.join()
+            final = proc_status(server.pid)
+            spawns = read_spawns(spawn_log)
+            report = {
+                "server": os.path.abspath(args.server),
+                "server_args": args.server_args,
+                "scenarios": results,
+                "server_process": {
+                    "peak_rss_kb": final.get("VmHWM"),
+                    "rss_kb": final.get("VmRSS"),
+                    "peak_threads": peak_threads[0],
+                },
+                "subprocesses": {
+                    "total": sum(spawns.values()),
+                    "by_command": dict(sorted(spawns.items())),
+                },
+            }
+        finally:
+            server.terminate()
+            server.wait()
+
+    output = json.dumps(report, indent=2) + "\n"
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        sys.stdout.write(output)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
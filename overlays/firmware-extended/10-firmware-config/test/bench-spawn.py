@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+
+# Command spawn latency benchmark for firmware-config.py.
+#
+# Grows this process to the RSS of a running server (bench-load.py reports
+# it), then runs a short shell command many times from several threads with:
+#
+#   fork         subprocess.run() forced to fork() by a preexec_fn, the path
+#                taken by Pythons without vfork support in _posixsubprocess
+#   subprocess   subprocess.run() as used before the posix_spawn runner
+#   posix_spawn  run_command() from firmware-config.py
+#
+#   ./bench-spawn.py --rss-mb 40 --threads 4
+
+import argparse
+import importlib.machinery
+import importlib.util
+import json
+import math
+import os
+import subprocess
+import sys
+import threading
+import time
+
+ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+DEFAULT_SERVER = os.path.join(ROOT_DIR, "root/usr/local/bin/firmware-config.py")
+COMMAND = "echo ok"
+
+def load_server(path):
+    loader = importlib.machinery.SourceFileLoader("firmware_config", path)
+    spec = importlib.util.spec_from_loader("firmware_config", loader)
+    module = importlib.util.module_from_spec(spec)
+    loader.exec_module(module)
+    return module
+
+def rss_kb():
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    return 0
+
+def grow_rss(target_mb):
+    """Allocate and touch memory until the RSS reaches target_mb."""
+    ballast = []
+    while rss_kb() < target_mb * 1024:
+        block = bytearray(1024 * 1024)
+        for i in range(0, len(block), 4096):
+            block[i] = 1
+        ballast.append(block)
+    return ballast
+
+def percentile(sorted_values, p):
+    return sorted_values[max(0, math.ceil(p / 100 * len(sorted_values)) - 1)]
+
+def run_fork():
+    subprocess.run(COMMAND, shell=True, capture_output=True, timeout=5, preexec_fn=lambda: None)
+
+def run_subprocess():
+    subprocess.run(COMMAND, shell=True, capture_output=True, timeout=5)
+
+def measure(fn, count, threads):
+    latencies = []
+    lock = threading.Lock()
+    per_thread = max(1, count // threads)
+
+    def worker():
+        local = []
+        for _ in range(per_thread):
+            start = time.perf_counter()
+            fn()
+            local.append(time.perf_counter() - start)
+        with lock:
+            latencies.extend(local)
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    start = time.perf_counter()
+    for worker_thread in workers:
+        worker_thread.start()
+    for worker_thread in workers:
+        worker_thread.join()
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "spawns": len(latencies),
+        "spawns_per_second": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare command spawn latency at a given process size")
+    parser.add_argument("--server", default=DEFAULT_SERVER, help="Path to firmware-config.py providing run_command()")
+    parser.add_argument("--rss-mb", type=int, default=40, help="Grow this process to this RSS before measuring")
+    parser.add_argument("--count", type=int, default=400, help="Commands per method")
+    parser.add_argument("--threads", type=int, default=4, help="Threads spawning at the same time")
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+    args = parser.parse_args()
+
+    server = load_server(args.server)
+    methods = {
+        "fork": run_fork,
+        "subprocess": run_subprocess,
+        "posix_spawn": lambda: server.run_command(COMMAND, timeout=5, shell=True),
+    }
+
+    ballast = grow_rss(args.rss_mb)
+    results = {"rss_kb": rss_kb(), "threads": args.threads, "methods": {}}
+    for name, fn in methods.items():
+        measure(fn, 20, 1)
+        results["methods"][name] = measure(fn, args.count, args.threads)
+    del ballast
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return 0
+
+    print(f"RSS {results['rss_kb'] // 1024} MB, {args.threads} threads, {args.count} commands per method")
+    print(f"{'method':<12} {'spawn/s':>9} {'p50':>9} {'p95':>9} {'p99':>9}")
+    for name, result in results["methods"].items():
+        print(f"{name:<12} {result['spawns_per_second']:>9} {result['p50_ms']:>7}ms {result['p95_ms']:>7}ms {result['p99_ms']:>7}ms")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+
+# Upload throughput benchmark for firmware-config.py.
+#
+# Starts firmware-config.py with a throwaway functions directory, posts a
+# synthetic firmware image to /api/upgrade/upload and reports MB/s and the
+# peak RSS of the server. Pass --server to compare against another revision:
+#
+#   git show HEAD~1:overlays/firmware-extended/10-firmware-config/root/usr/local/bin/firmware-config.py > /tmp/old.py
+#   ./bench-upload.py --server /tmp/old.py
+#   ./bench-upload.py
+
+import argparse
+import http.client
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+DEFAULT_SERVER = os.path.join(ROOT_DIR, "root/usr/local/bin/firmware-config.py")
+
+UPGRADE_YAML = """
+upgrade_upload:
+  title: Benchmark Upload
+  upload_path: {upload_path}
+  shell: echo "received $1"
+"""
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def wait_for_port(port, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            return True
+        except OSError:
+            time.sleep(0.05)
+    return False
+
+def peak_rss_kb(pid):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+def multipart_body(boundary, size_mb):
+    block = os.urandom(1024 * 1024)
+    head = (f"--{boundary}\r\n"
+            f'Content-Disposition: form-data; name="file"; filename="firmware.bin"\r\n'
+            f"Content-Type: application/octet-stream\r\n\r\n").encode()
+    tail = f"\r\n--{boundary}--\r\n".encode()
+
+    def chunks():
+        yield head
+        for _ in range(size_mb):
+            yield block
+        yield tail
+
+    return len(head) + size_mb * len(block) + len(tail), chunks()
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark firmware-config.py uploads")
+    parser.add_argument("--server", default=DEFAULT_SERVER, help="Path to firmware-config.py")
+    parser.add_argument("--size-mb", type=int, default=256, help="Size of the synthetic image in MB")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        functions_dir = os.path.join(tmp, "functions")
+        os.makedirs(functions_dir)
+        with open(os.path.join(functions_dir, "30_upgrade.yaml"), "w") as f:
+            f.write(UPGRADE_YAML.format(upload_path=os.path.join(tmp, "upload.bin")))
+
+        port = free_port()
+        server = subprocess.Popen(
+            [sys.executable, args.server, "--bind", "127.0.0.1", "--port", str(port),
+             "--html-dir", tmp, "--functions-dir", functions_dir],
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+        try:
+            if not wait_for_port(port):
+                print("ERROR: server did not start", file=sys.stderr)
+                return 1
+
+            boundary = "benchboundary" + os.urandom(8).hex()
+            length, body = multipart_body(boundary, args.size_mb)
+            rss_before = peak_rss_kb(server.pid)
+
+            start = time.monotonic()
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=600)
+            conn.request("POST", "/api/upgrade/upload", body=body, headers={
+                "Content-Type": f"multipart/form-data; boundary={boundary}",
+                "Content-Length": str(length),
+            })
+            resp = conn.getresponse()
+            output = resp.read().decode("utf-8", "replace")
+            elapsed = time.monotonic() - start
+            conn.close()
+
+            print(f"Server:     {args.server}")
+            print(f"Status:     {resp.status}")
+            print(f"Size:       {args.size_mb} MB")
+            print(f"Time:       {elapsed:.2f} s")
+            print(f"Throughput: {args.size_mb / elapsed:.1f} MB/s")
+            print(f"Peak RSS:   {rss_before} kB at start, {peak_rss_kb(server.pid)} kB after upload")
+            for line in output.splitlines():
+                if line.startswith(("SHA256:", "SUCCESS:", "ERROR:")):
+                    print(f"Server:     {line}")
+        finally:
+            server.terminate()
+            server.wait()
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+
+# Exercises download_with_resume() from firmware-config.py against a local
+# HTTP server that drops connections partway through a response. The
+# transfer runs through curl as on the printer, the one on PATH by default.
+#
+#   ./download-resume.py [--size-mb 16] [--drop-after-kb 1024] [--curl /usr/bin/curl]
+
+import argparse
+import hashlib
+import importlib.machinery
+import importlib.util
+import os
+import shutil
+import sys
+import tempfile
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+SERVER = os.path.join(ROOT_DIR, "root/usr/local/bin/firmware-config.py")
+
+def load_firmware_config():
+    loader = importlib.machinery.SourceFileLoader("firmware_config", SERVER)
+    spec = importlib.util.spec_from_loader(loader.name, loader)
+    module = importlib.util.module_from_spec(spec)
+    loader.exec_module(module)
+    return module
+
+class FlakyHandler(BaseHTTPRequestHandler):
+    payload = b""
+    etag = '"v1"'
+    drop_after = 0
+    honor_range = True
+    change_after = 0
+    requests = 0
+
+    def log_message(self, _format, *_args):
+        pass
+
+    def do_GET(self):
+        type(self).requests += 1
+        if self.change_after and self.requests > self.change_after:
+            # The file was replaced on the server, If-Range no longer matches
+            type(self).etag = '"v2"'
+        start = 0
+        range_header = self.headers.get("Range")
+        if range_header and self.honor_range and self.headers.get("If-Range", self.etag) == self.etag:
+            start = int(range_header.split("=")[1].split("-")[0])
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{len(self.payload) - 1}/{len(self.payload)}")
+        else:
+            self.send_response(200)
+        self.send_header("Content-Length", str(len(self.payload) - start))
+        self.send_header("ETag", self.etag)
+        self.end_headers()
+
+        end = len(self.payload)
+        if self.drop_after:
+            end = min(end, start + self.drop_after)
+        self.wfile.write(self.payload[start:end])
+        self.wfile.flush()
+        # Returning early closes the connection before Content-Length is reached
+        self.close_connection = True
+
+class CountingValidator:
+    """Stands in for FirmwareImageValidator, counts the bytes fed since the last reset."""
+
+    def __init__(self):
+        self.content_length = None
+        self.received = 0
+        self.resets = 0
+
+    def reset(self, content_length=None):
+        self.content_length = content_length
+        self.received = 0
+        self.resets += 1
+
+    def feed(self, data):
+        self.received += len(data)
+
+    def finish(self):
+        pass
+
+def run(fc, curl, name, size, drop_after, honor_range, change_after=0):
+    payload = os.urandom(size)
+    FlakyHandler.payload = payload
+    FlakyHandler.drop_after = drop_after
+    FlakyHandler.honor_range = honor_range
+    FlakyHandler.change_after = change_after
+    FlakyHandler.etag = '"v1"'
+    FlakyHandler.requests = 0
+    validator = CountingValidator()
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FlakyHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/firmware.bin"
+    progress_lines = []
+
+    with tempfile.TemporaryDirectory() as tmp:
+        target = os.path.join(tmp, "download.bin")
+        try:
+            done, sha256 = fc.download_with_resume(
+                url, target, progress=lambda *args: progress_lines.append(args), validator=validator,
+                retries=3 if not honor_range else 1000, backoff=0.01, progress_interval=0, curl=curl)
+            with open(target, "rb") as f:
+                ok = f.read() == payload and sha256 == hashlib.sha256(payload).hexdigest()
+            result = "OK" if ok else "FAIL (content mismatch)"
+            if ok and validator.received != size:
+                ok = False
+                result = f"FAIL (validator fed {validator.received} bytes after {validator.resets} resets)"
+        except fc.DownloadError as e:
+            ok = not honor_range and drop_after > 0
+            result = f"{'OK' if ok else 'FAIL'} (DownloadError: {e})"
+    server.shutdown()
+
+    print(f"{name}: {result}, {FlakyHandler.requests} requests, {len(progress_lines)} progress updates")
+    return ok
+
+def main():
+    parser = argparse.ArgumentParser(description="Test resumable downloads against a flaky HTTP server")
+    parser.add_argument("--size-mb", type=int, default=16, help="Size of the served file in MB")
+    parser.add_argument("--drop-after-kb", type=int, default=1024, help="Drop each response after this many KB")
+    parser.add_argument("--curl", default=shutil.which("curl"), help="curl binary used for the transfer")
+    args = parser.parse_args()
+    if not args.curl:
+        parser.error("curl not found, pass --curl")
+
+    fc = load_firmware_config()
+    fc.log = lambda msg: None
+    size = args.size_mb * 1024 * 1024
+    drop = args.drop_after_kb * 1024
+
+    results = [
+        run(fc, args.curl, "complete download", size, 0, True),
+        run(fc, args.curl, "resume after dropped connections", size, drop, True),
+        run(fc, args.curl, "file replaced while resuming", size, drop, True, change_after=2),
+        run(fc, args.curl, "server ignoring Range gives up", size, drop, False),
+    ]
+    return 0 if all(results) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,50 @@
+#!/bin/sh
+
+# Deterministic stand-in for the printer commands used by the fixture functions:
+#
+#   stub.sh <name> value <text>       print text
+#   stub.sh <name> sleep <seconds>    sleep, then print name
+#   stub.sh <name> fail               print to stderr and exit 1
+#   stub.sh <name> large <bytes>      print bytes of output
+#   stub.sh <name> get <default>      print the stored value of name, or default
+#   stub.sh <name> set <value>        store value for name
+#
+# Every call appends name to $BENCH_SPAWN_LOG, so the benchmark can count
+# the commands started by firmware-config.py.
+
+NAME="$1"
+MODE="$2"
+ARG="$3"
+
+if [ -n "$BENCH_SPAWN_LOG" ]; then
+  echo "$NAME" >> "$BENCH_SPAWN_LOG"
+fi
+
+case "$MODE" in
+  value)
+    echo "$ARG"
+    ;;
+  sleep)
+    sleep "$ARG"
+    echo "$NAME"
+    ;;
+  fail)
+    echo "$NAME failed" >&2
+    exit 1
+    ;;
+  large)
+    head -c "$ARG" /dev/zero | tr '\0' 'x'
+    echo
+    ;;
+  get)
+    cat "$BENCH_STATE_DIR/$NAME" 2>/dev/null || echo "$ARG"
+    ;;
+  set)
+    echo "$ARG" > "$BENCH_STATE_DIR/$NAME"
+    echo "$NAME set to $ARG"
+    ;;
+  *)
+    echo "Usage: $0 <name> value|sleep|fail|large|get|set [arg]" >&2
+    exit 2
+    ;;
+esac
@@ -1,7 +1,8 @@
+import collections
 import copy
-import io
 import json
 import logging
+import threading
 from . import filament_protocol
 
 NDEF_OK = 0
@@ -9,6 +10,128 @@ NDEF_ERR = -1
 NDEF_PARAMETER_ERR = -2
 NDEF_NOT_FOUND_ERR = -3
 
+NDEF_CC_MAGIC = 0xE1
+NDEF_CC_VERSIONS = (0x10, 0x11, 0x40)
+NDEF_CC_PAGE_OFFSET = 12        # the CC is page 3 of an image read from page 0
+
+NDEF_TLV_NULL = 0x00
+NDEF_TLV_LOCK_CONTROL = 0x01
+NDEF_TLV_MEMORY_CONTROL = 0x02
+NDEF_TLV_MESSAGE = 0x03
+NDEF_TLV_TERMINATOR = 0xFE
+
+NDEF_FLAG_ME = 0x40
+NDEF_FLAG_CF = 0x20
+NDEF_FLAG_SR = 0x10
+NDEF_FLAG_IL = 0x08
+NDEF_TNF_MIME = 0x02
+NDEF_TNF_UNCHANGED = 0x06
+
+NDEF_CACHE_SIZE = 16
+NDEF_CACHE_PROBE_OFFSET = 12    # page 3: CC and the first 12 bytes of the TLV area
+NDEF_CACHE_PROBE_SIZE = 16
+
+class NdefInfoCache:
+    """LRU cache of tag images and parsed filament info, by tag UID and probe.
+
+    The probe are the 16 bytes from page 3 on (the CC, the NDEF TLV header
+    and the start of the first record), which a single READ returns. The
+    reader looks up the image of a known tag with the probe instead of
+    reading it again, through the callbacks FilamentProtocolNdef registers
+    with it. filament_detect looks up the parsed info for the image of a
+    channel instead of parsing it again. The entry of a channel is dropped
+    when its tag is removed, so a tag rewritten outside of the printer is
+    always read again.
+    """
+
+    def __init__(self, size=NDEF_CACHE_SIZE):
+        self.size = size
+        self._entries = collections.OrderedDict()
+        self._channels = {}
+        self._lock = threading.Lock()
+        self.stats = {'image_hits': 0, 'image_misses': 0, 'info_hits': 0, 'info_misses': 0,
+                      'invalidations': 0}
+
+    def _bind(self, channel, key):
+        self._entries.move_to_end(key)
+        self._channels[channel] = key
+
+    def _store(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.size:
+            old_key, _ = self._entries.popitem(last=False)
+            for channel in [ch for ch, k in self._channels.items() if k == old_key]:
+                del self._channels[channel]
+
+    def find_image(self, channel, uid, probe):
+        """Image of the tag with this UID and probe if its info is cached, else None."""
+        key = (tuple(uid), bytes(probe[:NDEF_CACHE_PROBE_SIZE]))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry['info'] is None:
+                self.stats['image_misses'] += 1
+                return None
+            self.stats['image_hits'] += 1
+            self._bind(channel, key)
+            return list(entry['image'])
+
+    def add_image(self, channel, uid, image):
+        """Remember the image read from the tag on channel, its info is added by set_info().
+
+        The previous entry of the channel is dropped, its tag was replaced
+        or rewritten.
+        """
+        if self.size <= 0 or len(image) < NDEF_CACHE_PROBE_OFFSET + NDEF_CACHE_PROBE_SIZE:
+            return
+        probe = image[NDEF_CACHE_PROBE_OFFSET:NDEF_CACHE_PROBE_OFFSET + NDEF_CACHE_PROBE_SIZE]
+        key = (tuple(uid), bytes(probe))
+        with self._lock:
+            old_key = self._channels.get(channel)
+            if old_key is not None and old_key != key:
+                self._entries.pop(old_key, None)
+            self._store(key, {'uid': list(uid), 'image': list(image), 'info': None})
+            self._channels[channel] = key
+
+    def get_info(self, channel, image):
+        """Copy of the cached info if image is the tag image of channel, else None."""
+        with self._lock:
+            entry = self._entries.get(self._channels.get(channel))
+            if entry is None or entry['info'] is None or entry['image'] != list(image):
+                self.stats['info_misses'] += 1
+                return None
+            self.stats['info_hits'] += 1
+            return copy.deepcopy(entry['info'])
+
+    def set_info(self, channel, image, info):
+        with self._lock:
+            entry = self._entries.get(self._channels.get(channel))
+            if entry is not None and entry['image'] == list(image):
+                entry['info'] = copy.deepcopy(info)
+
+    def invalidate(self, channel=None):
+        """Drop the entry of the tag on channel, or all entries if channel is None."""
+        with self._lock:
+            if channel is None:
+                self.stats['invalidations'] += len(self._entries)
+                self._entries.clear()
+                self._channels.clear()
+                return
+            key = self._channels.pop(channel, None)
+            if key is not None and self._entries.pop(key, None) is not None:
+                self.stats['invalidations'] += 1
+
+    def get_status(self):
+        with self._lock:
+            status = dict(self.stats)
+            status['size'] = self.size
+            status['entries'] = len(self._entries)
+            status['channels'] = {str(channel): ''.join('%02X' % b for b in key[0])
+                                  for channel, key in sorted(self._channels.items())}
+        return status
+
+NDEF_INFO_CACHE = NdefInfoCache()
+
 def xxd_dump(data, max_lines=16):
     if isinstance(data, list):
         data = bytes(data)
@@ -26,105 +149,239 @@ def xxd_dump(data, max_lines=16):
 
     return '\n'.join(lines)
 
-def ndef_parse(data_buf):
-    if None == data_buf or isinstance(data_buf, (list, bytes, bytearray)) == False:
-        return NDEF_PARAMETER_ERR, []
-
-    try:
-        data = bytes(data_buf) if isinstance(data_buf, list) else data_buf
-
-        logging.info("NDEF RFID data:")
-        logging.info("\n" + xxd_dump(data))
-
-        data_io = io.BytesIO(data)
-
-        start_offset = 0
-        if len(data) > 12 and data[0] != 0xE1:
-            for i in range(min(16, len(data) - 4)):
-                if data[i] == 0xE1 and (data[i+1] == 0x10 or data[i+1] == 0x11 or data[i+1] == 0x40):
-                    start_offset = i
-                    break
+class NdefError(Exception):
+    """NDEF parse error, code is one of the NDEF_* codes and offset the byte in the tag image."""
+
+    def __init__(self, code, reason, offset=None):
+        super().__init__(reason)
+        self.code = code
+        self.reason = reason
+        self.offset = offset
+
+    def __str__(self):
+        if self.offset is None:
+            return f"{self.reason} (code: {self.code})"
+        return f"{self.reason} at byte {self.offset} (code: {self.code})"
+
+class NdefRecord:
+    """Record of an NDEF message, a view of its bytes in the tag image.
+
+    Only the positions are kept while parsing, type, id and payload are
+    memoryviews created on access. The payload of a chunked record is
+    joined the first time it is accessed.
+    """
+
+    __slots__ = ('tnf', 'offset', '_message', '_type_pos', '_id_pos', '_payload_pos', '_payload_end', '_chunks')
+
+    def __init__(self, tnf, message, type_pos, id_pos, payload_pos, payload_end, offset):
+        self.tnf = tnf
+        self.offset = offset
+        self._message = message
+        self._type_pos = type_pos
+        self._id_pos = id_pos
+        self._payload_pos = payload_pos
+        self._payload_end = payload_end
+        self._chunks = None
+
+    @property
+    def type(self):
+        return self._message[self._type_pos:self._id_pos]
+
+    @property
+    def id(self):
+        return self._message[self._id_pos:self._payload_pos]
+
+    @property
+    def mime_type(self):
+        return str(self._message[self._type_pos:self._id_pos], 'ascii', 'ignore')
+
+    @property
+    def payload(self):
+        if self._chunks is not None:
+            chunks = [self._message[start:end] for start, end in self._chunks]
+            self._message = memoryview(b''.join(chunks))
+            self._type_pos = self._id_pos = self._payload_pos = 0
+            self._payload_end = len(self._message)
+            self._chunks = None
+        return self._message[self._payload_pos:self._payload_end]
+
+    @property
+    def payload_len(self):
+        if self._chunks is not None:
+            return sum(end - start for start, end in self._chunks)
+        return self._payload_end - self._payload_pos
+
+def ndef_find_cc(data):
+    """Offset of the capability container, at 0 or on page 3 of a full image."""
+    if len(data) > 12 and data[0] != NDEF_CC_MAGIC:
+        for i in range(min(16, len(data) - 4)):
+            if data[i] == NDEF_CC_MAGIC and data[i + 1] in NDEF_CC_VERSIONS:
+                return i
+    if len(data) < 4 or data[0] != NDEF_CC_MAGIC:
+        raise NdefError(NDEF_PARAMETER_ERR, "Capability container not found", 0)
+    return 0
+
+def _ndef_reserved_area(value, base, lock_control):
+    """(start, end) of the memory a lock or memory control TLV reserves in the image."""
+    if len(value) < 3:
+        return None
+    bytes_per_page = 1 << (value[2] & 0x0F)
+    start = base + (value[0] >> 4) * bytes_per_page + (value[0] & 0x0F)
+    size = value[1] or 256
+    if lock_control:
+        size = (size + 7) // 8
+    return start, start + size
+
+def _ndef_tlv_value(view, pos, length, reserved):
+    """Value of a TLV, a slice of view unless a reserved area lies inside it."""
+    parts = []
+    for start, end in reserved:
+        if start >= pos + length or end <= pos:
+            continue
+        if start > pos:
+            parts.append(view[pos:start])
+            length -= start - pos
+        pos = end
+    if not parts:
+        return view[pos:pos + length], pos + length
+    parts.append(view[pos:pos + length])
+    return memoryview(b''.join(parts)), pos + length
+
+def _ndef_message_records(message, offset):
+    """Yield the records of the NDEF message in a memoryview, offset is its start in the image."""
+    size = len(message)
+    pos = 0
+    chunked = None
+    while pos < size:
+        record_offset = offset + pos
+        if pos + 3 > size:
+            raise NdefError(NDEF_ERR, "Truncated record header", record_offset)
+        header = message[pos]
+        type_len = message[pos + 1]
+        pos += 2
+        if header & NDEF_FLAG_SR:
+            payload_len = message[pos]
+            pos += 1
+        else:
+            if pos + 4 > size:
+                raise NdefError(NDEF_ERR, "Truncated record header", record_offset)
+            payload_len = int.from_bytes(message[pos:pos + 4], 'big')
+            pos += 4
+        id_len = 0
+        if header & NDEF_FLAG_IL:
+            if pos >= size:
+                raise NdefError(NDEF_ERR, "Truncated record header", record_offset)
+            id_len = message[pos]
+            pos += 1
+        if pos + type_len + id_len + payload_len > size:
+            raise NdefError(NDEF_ERR, f"Record of {payload_len} bytes exceeds the NDEF message", record_offset)
+        type_pos = pos
+        id_pos = type_pos + type_len
+        payload_pos = id_pos + id_len
+        pos = payload_pos + payload_len
+
+        tnf = header & 0x07
+        if chunked is not None:
+            if tnf != NDEF_TNF_UNCHANGED or type_len:
+                raise NdefError(NDEF_ERR, "Invalid record chunk", record_offset)
+            chunked._chunks.append((payload_pos, pos))
+            if not header & NDEF_FLAG_CF:
+                yield chunked
+                chunked = None
+        elif tnf == NDEF_TNF_UNCHANGED:
+            raise NdefError(NDEF_ERR, "Record chunk without a first chunk", record_offset)
+        elif header & NDEF_FLAG_CF:
+            chunked = NdefRecord(tnf, message, type_pos, id_pos, payload_pos, pos, record_offset)
+            chunked._chunks = [(payload_pos, pos)]
+        else:
+            yield NdefRecord(tnf, message, type_pos, id_pos, payload_pos, pos, record_offset)
+
+        if header & NDEF_FLAG_ME:
+            break
+    if chunked is not None:
+        raise NdefError(NDEF_ERR, "Chunked record without its last chunk", offset + pos)
+
+def ndef_iter_records(data):
+    """Yield the records of all NDEF message TLVs in a tag image, raises NdefError.
+
+    data is bytes, bytearray or a memoryview, the TLV area starts after the
+    capability container. Lock and memory control TLVs reserve memory which
+    is skipped inside the following TLVs.
+    """
+    view = memoryview(data)
+    cc = ndef_find_cc(view)
+    base = cc - NDEF_CC_PAGE_OFFSET
+    reserved = []
+    size = len(view)
+    pos = cc + 4
+    while pos < size:
+        for start, end in reserved:
+            if start <= pos < end:
+                pos = end
+        if pos >= size:
+            break
+        tag = view[pos]
+        if tag == NDEF_TLV_TERMINATOR:
+            break
+        if tag == NDEF_TLV_NULL:
+            pos += 1
+            continue
+        if pos + 2 > size:
+            raise NdefError(NDEF_ERR, f"Truncated TLV 0x{tag:02X}", pos)
+        length = view[pos + 1]
+        value_pos = pos + 2
+        if length == 0xFF:
+            if pos + 4 > size:
+                raise NdefError(NDEF_ERR, f"Truncated TLV 0x{tag:02X}", pos)
+            length = (view[pos + 2] << 8) | view[pos + 3]
+            value_pos = pos + 4
+        if tag in (NDEF_TLV_LOCK_CONTROL, NDEF_TLV_MEMORY_CONTROL):
+            area = _ndef_reserved_area(view[value_pos:value_pos + length], base,
+                                       tag == NDEF_TLV_LOCK_CONTROL)
+            if area is not None and area[0] >= value_pos + length:
+                reserved.append(area)
+                reserved.sort()
+        value, next_pos = _ndef_tlv_value(view, value_pos, length, reserved)
+        if tag == NDEF_TLV_MESSAGE:
+            yield from _ndef_message_records(value, value_pos)
+        if next_pos > size:
+            raise NdefError(NDEF_ERR, f"TLV 0x{tag:02X} of {length} bytes exceeds the tag data", pos)
+        pos = next_pos
 
-        if start_offset > 0:
-            data_io.seek(start_offset)
+def ndef_parse(data_buf):
+    """Parse the NDEF records of a tag image, returns (NDEF_OK, records) or (NDEF_* code, []).
 
-        cc = data_io.read(4)
-        if len(cc) < 4 or cc[0] != 0xE1:
+    The reason and the offset of an error are logged, ndef_iter_records()
+    raises them as an NdefError.
+    """
+    if isinstance(data_buf, list):
+        try:
+            data_buf = bytes(data_buf)
+        except (ValueError, TypeError):
+            logging.error("NDEF parsing failed: Tag data is not a list of bytes")
             return NDEF_PARAMETER_ERR, []
+    elif not isinstance(data_buf, (bytes, bytearray, memoryview)):
+        logging.error("NDEF parsing failed: Invalid tag data parameter")
+        return NDEF_PARAMETER_ERR, []
 
-        records = []
-
-        while True:
-            base_tlv = data_io.read(2)
-            if len(base_tlv) < 2:
-                break
-
-            tag = base_tlv[0]
-            if tag == 0xFE:
-                break
-
-            tlv_len = base_tlv[1]
-            if tlv_len == 0xFF:
-                ext_len = data_io.read(2)
-                if len(ext_len) < 2:
-                    break
-                tlv_len = (ext_len[0] << 8) | ext_len[1]
-
-            if tag == 0x03:
-                ndef_data = data_io.read(tlv_len)
-                ndef_offset = 0
-
-                while ndef_offset < len(ndef_data) - 2:
-                    header = ndef_data[ndef_offset]
-                    ndef_offset += 1
-
-                    tnf = header & 0x07
-                    sr_flag = (header >> 4) & 0x01
-                    il_flag = (header >> 3) & 0x01
-
-                    type_len = ndef_data[ndef_offset]
-                    ndef_offset += 1
-
-                    if sr_flag:
-                        payload_len = ndef_data[ndef_offset]
-                        ndef_offset += 1
-                    else:
-                        if ndef_offset + 4 > len(ndef_data):
-                            break
-                        payload_len = (ndef_data[ndef_offset] << 24) | (ndef_data[ndef_offset + 1] << 16) | (ndef_data[ndef_offset + 2] << 8) | ndef_data[ndef_offset + 3]
-                        ndef_offset += 4
-
-                    id_len = 0
-                    if il_flag:
-                        id_len = ndef_data[ndef_offset]
-                        ndef_offset += 1
-
-                    if ndef_offset + type_len + id_len + payload_len > len(ndef_data):
-                        break
-
-                    mime_type = ndef_data[ndef_offset:ndef_offset + type_len].decode('ascii', errors='ignore')
-                    ndef_offset += type_len
-
-                    if id_len > 0:
-                        ndef_offset += id_len
-
-                    payload = bytes(ndef_data[ndef_offset:ndef_offset + payload_len])
-                    ndef_offset += payload_len
-
-                    if tnf == 0x02:
-                        records.append({'mime_type': mime_type, 'payload': payload})
-                        logging.info(f"NDEF record found: mime_type='{mime_type}', payload_len={len(payload)}")
-            else:
-                data_io.seek(tlv_len, 1)
-
+    records = []
+    try:
+        for record in ndef_iter_records(data_buf):
+            records.append(record)
+    except NdefError as e:
+        # Keep the records before the damaged one, as a partial read would
+        log = logging.warning if records else logging.error
+        log(f"NDEF parsing failed: {e}, NDEF RFID data:\n{xxd_dump(bytes(data_buf))}")
         if not records:
-            return NDEF_NOT_FOUND_ERR, []
+            return e.code, []
 
-        return NDEF_OK, records
+    if not records:
+        return NDEF_NOT_FOUND_ERR, []
 
-    except Exception as e:
-        logging.exception("NDEF parsing failed: %s", str(e))
-        return NDEF_ERR, []
+    for record in records:
+        logging.info("NDEF record found: tnf=%d, mime_type='%s', payload_len=%d",
+                     record.tnf, record.mime_type, record.payload_len)
+    return NDEF_OK, records
 
 def parse_color_hex(value):
     try:
@@ -136,13 +393,13 @@ def parse_color_hex(value):
         return 0xFFFFFF
 
 def openspool_parse_payload(payload):
-    if None == payload or not isinstance(payload, (bytes, bytearray)):
+    if None == payload or not isinstance(payload, (bytes, bytearray, memoryview)):
         logging.error("OpenSpool payload parsing failed: Invalid payload parameter")
         return filament_protocol.FILAMENT_PROTO_PARAMETER_ERR, None
 
     try:
-        payload_str = payload.decode('utf-8')
-        logging.info(f"OpenSpool JSON payload: {payload_str}")
+        payload_str = str(payload, 'utf-8')
+        logging.info("OpenSpool JSON payload: %s", payload_str)
 
         data = json.loads(payload_str)
 
@@ -229,6 +486,24 @@ def openspool_parse_payload(payload):
         logging.exception("OpenSpool payload parsing failed: %s", str(e))
         return filament_protocol.FILAMENT_PROTO_ERR, None
 
+def _ndef_json_payloads(records):
+    """Copies of the application/json payloads of records.
+
+    The payloads are small, once they are copied the records and the tag
+    image they view can be freed before the JSON is decoded.
+    """
+    payloads = []
+    for record in records:
+        if record.tnf != NDEF_TNF_MIME:
+            continue
+
+        mime_type = record.mime_type
+        if mime_type == 'application/json':
+            payloads.append(bytes(record.payload))
+        else:
+            logging.warning(f"Skipping unsupported MIME type '{mime_type}'")
+    return payloads
+
 def ndef_proto_data_parse(data_buf):
     error, records = ndef_parse(data_buf)
 
@@ -236,30 +511,56 @@ def ndef_proto_data_parse(data_buf):
         logging.error(f"NDEF parse failed: NDEF parsing error (code: {error})")
         return filament_protocol.FILAMENT_PROTO_ERR, None
 
-    if not records:
-        logging.error("NDEF parse failed: No records found")
-        return filament_protocol.FILAMENT_PROTO_ERR, None
-
-    for record in records:
-        mime_type = record['mime_type']
-        payload = record['payload']
-
-        if mime_type == 'application/json':
-            logging.info(f"Detected OpenSpool format, parsing payload ({len(payload)} bytes)")
-            error_code, info = openspool_parse_payload(payload)
-            if error_code != filament_protocol.FILAMENT_PROTO_OK:
-                logging.error(f"OpenSpool parse failed: Payload parsing error (code: {error_code})")
-                continue
-            else:
-                logging.info(f"OpenSpool parse success: vendor={info.get('VENDOR')}, type={info.get('MAIN_TYPE')}")
-                return error_code, info
+    payloads = _ndef_json_payloads(records)
+    del records
 
+    for payload in payloads:
+        logging.info("Detected OpenSpool format, parsing payload (%d bytes)", len(payload))
+        error_code, info = openspool_parse_payload(payload)
+        if error_code != filament_protocol.FILAMENT_PROTO_OK:
+            logging.error(f"OpenSpool parse failed: Payload parsing error (code: {error_code})")
+            continue
         else:
-            logging.warning(f"Skipping unsupported MIME type '{mime_type}'")
+            logging.info("OpenSpool parse success: vendor=%s, type=%s", info.get('VENDOR'), info.get('MAIN_TYPE'))
+            return error_code, info
 
     logging.error("NDEF parse failed: No supported records found")
     return filament_protocol.FILAMENT_PROTO_SIGN_CHECK_ERR, None
 
+class FilamentProtocolNdef:
+    """Klipper status of the NDEF cache and the NTAG reads, enabled by [filament_protocol_ndef]."""
+
+    def __init__(self, config):
+        self.printer = config.get_printer()
+        NDEF_INFO_CACHE.size = config.getint('cache_size', NDEF_CACHE_SIZE, minval=0)
+        gcode = self.printer.lookup_object('gcode')
+        gcode.register_command('NDEF_CACHE_CLEAR', self.cmd_NDEF_CACHE_CLEAR,
+                               desc=self.cmd_NDEF_CACHE_CLEAR_help)
+        self.printer.register_event_handler('klippy:connect', self._handle_connect)
+
+    def _handle_connect(self):
+        reader = self.printer.lookup_object('fm175xx_reader', None)
+        if reader is not None:
+            reader.register_ntag_image_cb(NDEF_INFO_CACHE.find_image, NDEF_INFO_CACHE.add_image)
+
+    cmd_NDEF_CACHE_CLEAR_help = "Forget cached NTAG filament info, for CHANNEL or all channels"
+    def cmd_NDEF_CACHE_CLEAR(self, gcmd):
+        channel = gcmd.get_int('CHANNEL', None, minval=0)
+        NDEF_INFO_CACHE.invalidate(channel)
+        gcmd.respond_info("NDEF cache cleared")
+
+    def get_status(self, eventtime):
+        status = {'cache': NDEF_INFO_CACHE.get_status(), 'ntag_reads': {}}
+        reader = self.printer.lookup_object('fm175xx_reader', None)
+        if reader is not None:
+            # A copy made by the reader, its thread updates the counters
+            status['ntag_reads'] = {str(channel): {k: v for k, v in stats.items() if k != 'fast_read_failed_uid'}
+                                    for channel, stats in reader.get_ntag_stats().items()}
+        return status
+
+def load_config(config):
+    return FilamentProtocolNdef(config)
+
 if __name__ == '__main__':
     import sys
     import argparse
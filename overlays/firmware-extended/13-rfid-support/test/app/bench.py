@@ -0,0 +1,97 @@
+import argparse
+import importlib.machinery
+import importlib.util
+import json
+import logging
+import sys
+import time
+import tracemalloc
+
+from . import filament_protocol_ndef
+from . import ntag_image
+
+def load_parser(path):
+    """Load another revision of filament_protocol_ndef.py next to the current one."""
+    name = f"{__package__}.filament_protocol_ndef_baseline"
+    loader = importlib.machinery.SourceFileLoader(name, path)
+    spec = importlib.util.spec_from_loader(name, loader)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+def parse_records(module, image):
+    """Parse image and touch the payload of every record, as the filament detection does."""
+    _, records = module.ndef_parse(image)
+    for record in records:
+        if isinstance(record, dict):
+            len(record['payload'])
+        else:
+            len(record.payload)
+    return records
+
+def measure(fn, images, rounds):
+    for image in images:
+        fn(image)
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for image in images:
+            fn(image)
+    elapsed = time.perf_counter() - start
+
+    allocated = 0
+    peak = 0
+    for image in images:
+        tracemalloc.start()
+        result = fn(image)
+        current, image_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        allocated += current
+        peak = max(peak, image_peak)
+        del result
+    return {
+        'us_per_tag': round(elapsed / (rounds * len(images)) * 1e6, 2),
+        'result_bytes_per_tag': allocated // len(images),
+        'peak_bytes': peak,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure NDEF parse time and allocations per tag')
+    parser.add_argument('--baseline', help='Another revision of filament_protocol_ndef.py to compare with')
+    parser.add_argument('--rounds', type=int, default=2000, help='Times each image is parsed')
+    parser.add_argument('--log-level', default='INFO', help='Log level, klippy logs INFO')
+    parser.add_argument('--json', action='store_true', help='Print the results as JSON')
+    args = parser.parse_args()
+
+    # Records are created as in klippy, without writing them anywhere
+    logging.basicConfig(level=args.log_level.upper(), handlers=[logging.NullHandler()])
+
+    modules = {'current': filament_protocol_ndef}
+    if args.baseline:
+        modules['baseline'] = load_parser(args.baseline)
+
+    fixtures = ntag_image.load_fixtures()
+    # The reader returns the image as a list of ints
+    images = [list(ntag_image.ntag_image([ntag_image.ndef_message(payload)])) for _, payload in fixtures]
+
+    results = {'tags': len(images), 'rounds': args.rounds, 'parsers': {}}
+    for name, module in modules.items():
+        results['parsers'][name] = {
+            'ndef_parse': measure(lambda image: parse_records(module, image), images, args.rounds),
+            'ndef_proto_data_parse': measure(module.ndef_proto_data_parse, images, args.rounds // 4 or 1),
+        }
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return 0
+
+    print(f"{len(images)} OpenSpool tags, log level {args.log_level.upper()}")
+    print(f"{'parser':<10} {'function':<22} {'us/tag':>9} {'kept B/tag':>11} {'peak B':>9}")
+    for name, functions in results['parsers'].items():
+        for function, result in functions.items():
+            print(f"{name:<10} {function:<22} {result['us_per_tag']:>9} "
+                  f"{result['result_bytes_per_tag']:>11} {result['peak_bytes']:>9}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
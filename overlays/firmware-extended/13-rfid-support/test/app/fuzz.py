@@ -0,0 +1,115 @@
+import argparse
+import logging
+import random
+import sys
+
+from . import filament_protocol
+from . import filament_protocol_ndef
+from . import ntag_image
+
+NDEF_CODES = (filament_protocol_ndef.NDEF_ERR, filament_protocol_ndef.NDEF_PARAMETER_ERR,
+              filament_protocol_ndef.NDEF_NOT_FOUND_ERR)
+PROTO_CODES = (filament_protocol.FILAMENT_PROTO_OK, filament_protocol.FILAMENT_PROTO_ERR,
+               filament_protocol.FILAMENT_PROTO_PARAMETER_ERR, filament_protocol.FILAMENT_PROTO_SIGN_CHECK_ERR)
+
+def mutate(rng, image):
+    """Return a copy of image with one or more random corruptions of the NDEF area."""
+    data = bytearray(image)
+    for _ in range(rng.randint(1, 4)):
+        if len(data) <= 16:
+            break
+        # Most interesting bytes are the CC, the TLV headers and the record headers
+        hot = min(len(data), 64)
+        kind = rng.randrange(6)
+        if kind == 0:
+            pos = rng.randrange(12, hot)
+            data[pos] ^= 1 << rng.randrange(8)
+        elif kind == 1:
+            data[rng.randrange(12, hot)] = rng.choice((0x00, 0x01, 0x02, 0x03, 0x06, 0xFE, 0xFF, rng.randrange(256)))
+        elif kind == 2:
+            del data[rng.randrange(12, len(data)):]
+        elif kind == 3:
+            pos = rng.randrange(12, len(data))
+            data[pos:pos + 4] = bytes(rng.randrange(256) for _ in range(4))
+        elif kind == 4:
+            # Long TLV and record lengths
+            pos = rng.randrange(16, hot)
+            data[pos:pos + 3] = bytes([0xFF, rng.randrange(256), rng.randrange(256)])
+        else:
+            pos = rng.randrange(12, len(data))
+            data[pos:pos] = bytes(rng.randrange(256) for _ in range(rng.randint(1, 8)))
+    return bytes(data)
+
+def check_corpus(corpus):
+    failures = 0
+    for name, image, payload in corpus:
+        error, records = filament_protocol_ndef.ndef_parse(image)
+        payloads = [bytes(record.payload) for record in records if record.tnf == filament_protocol_ndef.NDEF_TNF_MIME]
+        if error != filament_protocol_ndef.NDEF_OK or payload not in payloads:
+            print(f"FAIL {name}: {error}, {len(records)} records")
+            failures += 1
+            continue
+        code, info = filament_protocol_ndef.ndef_proto_data_parse(image)
+        if code != filament_protocol.FILAMENT_PROTO_OK:
+            print(f"FAIL {name}: filament info error {code}")
+            failures += 1
+    return failures
+
+def check_mutation(image):
+    """Parse a mutated image, return a failure description or None."""
+    try:
+        error, records = filament_protocol_ndef.ndef_parse(image)
+        if error == filament_protocol_ndef.NDEF_OK:
+            if not records:
+                return "NDEF_OK without records"
+            for record in records:
+                if not isinstance(record, filament_protocol_ndef.NdefRecord):
+                    return f"unexpected record {record!r}"
+                if len(record.payload) != record.payload_len:
+                    return "payload length mismatch"
+                record.mime_type
+        elif error not in NDEF_CODES or records:
+            return f"unexpected result {error!r}, {records!r}"
+        else:
+            try:
+                list(filament_protocol_ndef.ndef_iter_records(image))
+            except filament_protocol_ndef.NdefError as e:
+                if e.code != error:
+                    return f"ndef_iter_records raised code {e.code}, ndef_parse returned {error}"
+        code, _ = filament_protocol_ndef.ndef_proto_data_parse(image)
+        if code not in PROTO_CODES:
+            return f"unexpected filament info error {code}"
+    except Exception as e:
+        return f"{type(e).__name__}: {e}"
+    return None
+
+def main():
+    parser = argparse.ArgumentParser(description='Fuzz the NDEF parser with mutations of the OpenSpool fixtures')
+    parser.add_argument('--iterations', type=int, default=20000, help='Mutated images to parse')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed, the same seed parses the same images')
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+
+    corpus = ntag_image.corpus()
+    failures = check_corpus(corpus)
+    print(f"corpus: {len(corpus)} images, {failures} failures")
+
+    rng = random.Random(args.seed)
+    results = {'ok': 0, 'error': 0}
+    for i in range(args.iterations):
+        name, image, _ = corpus[rng.randrange(len(corpus))]
+        image = mutate(rng, bytes(image))
+        failure = check_mutation(image)
+        if failure is not None:
+            print(f"FAIL {name} iteration {i}: {failure}\n{image.hex()}")
+            failures += 1
+            continue
+        error, _ = filament_protocol_ndef.ndef_parse(image)
+        results['ok' if error == filament_protocol_ndef.NDEF_OK else 'error'] += 1
+    print(f"mutations: {args.iterations} images, {results['ok']} parsed, {results['error']} rejected, "
+          f"{failures} failures")
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,109 @@
+import glob
+import os
+
+TEST_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# NTAG215: 135 pages, CC size 0x3E (496 bytes of user memory from page 4)
+NTAG_TOTAL_PAGES = 135
+NTAG_CC_SIZE = 0x3E
+NTAG_UID = bytes([0x04, 0x11, 0x22, 0x33, 0x44, 0x55, 0x66])
+
+MIME_TYPE = b"application/json"
+
+def load_fixtures():
+    """Return (name, payload bytes) of the test/*.json OpenSpool fixtures."""
+    fixtures = []
+    for path in sorted(glob.glob(os.path.join(TEST_DIR, "*.json"))):
+        with open(path, "rb") as f:
+            fixtures.append((os.path.basename(path), f.read()))
+    return fixtures
+
+def ndef_record(tnf, record_type, payload, first=True, last=True, chunk=False, record_id=b""):
+    header = tnf
+    if first:
+        header |= 0x80
+    if last:
+        header |= 0x40
+    if chunk:
+        header |= 0x20
+    if record_id:
+        header |= 0x08
+    if len(payload) < 256:
+        out = bytes([header | 0x10, len(record_type), len(payload)])
+    else:
+        out = bytes([header, len(record_type)]) + len(payload).to_bytes(4, "big")
+    if record_id:
+        out += bytes([len(record_id)])
+    return out + record_type + record_id + payload
+
+def ndef_message(payload, chunk_size=None, extra_records=()):
+    """NDEF message with a MIME record of payload, split into chunks of chunk_size."""
+    records = list(extra_records)
+    if chunk_size:
+        chunks = [payload[i:i + chunk_size] for i in range(0, len(payload), chunk_size)]
+        parts = [ndef_record(0x02, MIME_TYPE, chunks[0], first=False, last=False, chunk=True)]
+        for i, chunk in enumerate(chunks[1:], 1):
+            parts.append(ndef_record(0x06, b"", chunk, first=False, last=False, chunk=i < len(chunks) - 1))
+    else:
+        parts = [ndef_record(0x02, MIME_TYPE, payload, first=False, last=False)]
+    records += parts
+    message = b""
+    for i, record in enumerate(records):
+        # Set MB on the first and ME on the last record
+        header = record[0] & ~0xC0
+        if i == 0:
+            header |= 0x80
+        if i == len(records) - 1:
+            header |= 0x40
+        message += bytes([header]) + record[1:]
+    return message
+
+def tlv(tag, value):
+    if len(value) < 0xFF:
+        return bytes([tag, len(value)]) + value
+    return bytes([tag, 0xFF]) + len(value).to_bytes(2, "big") + value
+
+def ntag_image(messages, total_pages=NTAG_TOTAL_PAGES, cc_size=NTAG_CC_SIZE, control_tlvs=b"",
+               reserved=None, terminator=True):
+    """Full tag image from page 0, as the reader returns it, with one NDEF TLV per message.
+
+    reserved is (offset, size) of an area to skip in the TLV stream, it is
+    filled with 0xA5 and described by a memory control TLV.
+    """
+    area = control_tlvs
+    if reserved is not None:
+        offset, size = reserved
+        # Major offsets of 16 bytes
+        area += tlv(0x02, bytes([((offset // 16) << 4) | (offset % 16), size, 0x04]))
+    for message in messages:
+        area += tlv(0x03, message)
+    if terminator:
+        area += b"\xFE"
+
+    image = bytearray(total_pages * 4)
+    image[0:7] = NTAG_UID
+    image[12:16] = bytes([0xE1, 0x10, cc_size, 0x00])
+    pos = 16
+    for b in area:
+        if reserved is not None and reserved[0] <= pos < reserved[0] + reserved[1]:
+            image[reserved[0]:reserved[0] + reserved[1]] = b"\xA5" * reserved[1]
+            pos = reserved[0] + reserved[1]
+        image[pos] = b
+        pos += 1
+    return bytes(image)
+
+def corpus():
+    """Return (name, image, expected payload) of the fixtures in the tag layouts the parser supports."""
+    # Dynamic lock bits of the NTAG215 at page 130, 8 * 64 + 8 bytes from page 0
+    lock_tlv = tlv(0x01, bytes([0x88, 0x18, 0x46]))
+    other_record = ndef_record(0x01, b"U", b"\x04example.com")
+    images = []
+    for name, payload in load_fixtures():
+        images.append((f"{name}:plain", ntag_image([ndef_message(payload)]), payload))
+        images.append((f"{name}:chunked", ntag_image([ndef_message(payload, chunk_size=48)]), payload))
+        images.append((f"{name}:uri-first", ntag_image([ndef_message(payload, extra_records=[other_record])]), payload))
+        images.append((f"{name}:two-tlvs", ntag_image([other_record, ndef_message(payload)]), payload))
+        images.append((f"{name}:lock-control", ntag_image([ndef_message(payload)], control_tlvs=lock_tlv), payload))
+        images.append((f"{name}:reserved", ntag_image([ndef_message(payload)], reserved=(64, 16)), payload))
+        images.append((f"{name}:list", list(ntag_image([ndef_message(payload)])), payload))
+    return images
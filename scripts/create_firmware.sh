@@ -97,6 +97,12 @@ for overlay; do
   fi
 done
 
+if [[ -f "$ROOTFS_DIR/usr/local/bin/firmware-config.py" ]]; then
+  echo ">> Generating firmware-config functions cache..."
+  chroot_firmware.sh "$ROOTFS_DIR" /usr/bin/python3 /usr/local/bin/firmware-config.py \
+    --functions-dir /usr/local/share/firmware-config/functions --generate-cache
+fi
+
 echo ">> Checking for non-ARM binaries in rootfs..."
 if FILES=$(find "$ROOTFS_DIR" -type f -exec file {} + | grep "ELF" | grep -v "ARM"); then
   echo "!! Error: Found non-ARM binaries in the rootfs:"